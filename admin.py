@@ -0,0 +1,88 @@
+# Admin view of the collected responses, opened with ?admin=<token>.
+# Nothing here runs for participants: the table is only read when this page renders,
+# one page of rows at a time, and the row count and summary are cached. The live
+# analytics are folded in incrementally by dashboard.LiveAggregates.
+
+import hmac
+import math
+
+import pandas as pd
+import streamlit as st
+
+import dashboard
+import storage
+
+PAGE_SIZE = 50
+
+
+def is_admin(token):
+    expected = st.secrets.get("admin", {}).get("token")
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(str(token), str(expected))
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_row_count(_engine):
+    return storage.count_responses(_engine)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_summary(_engine):
+    return pd.DataFrame(storage.summarize_responses(_engine))
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_page(_engine, page):
+    return pd.DataFrame(storage.read_responses_page(_engine, PAGE_SIZE, page * PAGE_SIZE))
+
+
+# One set of running aggregates per server process, topped up at most every REFRESH_SECONDS
+REFRESH_SECONDS = 30
+
+
+@st.cache_resource
+def live_aggregates(_engine):
+    return dashboard.LiveAggregates(_engine)
+
+
+@st.cache_data(ttl=REFRESH_SECONDS, show_spinner=False)
+def cached_live_summary(_engine):
+    aggregates = live_aggregates(_engine)
+    aggregates.refresh()
+    return aggregates.summary()
+
+
+def live_analytics(conn):
+    st.title("Live analytics")
+    summary = cached_live_summary(conn.engine)
+
+    columns = st.columns(len(summary["completed"]) + 2)
+    for column, (condition, count) in zip(columns, sorted(summary["completed"].items())):
+        column.metric(f"Completed, {condition}", count)
+    pass_rate = summary["attention_pass_rate"]
+    columns[-2].metric("Attention checks passed", "–" if pass_rate is None else f"{pass_rate:.0%}",
+                       help=f"{summary['attention_checked']} checks, ±{dashboard.ATTENTION_TOLERANCE} allowed")
+    median = summary["median_duration"]
+    columns[-1].metric("Median trial duration", "–" if median is None else f"{median:.1f} s")
+
+    st.subheader("Agreement with the AI by confidence range")
+    st.dataframe(pd.DataFrame(summary["agreement"]), hide_index=True)
+    st.caption(f"{summary['trials']} trials, attention checks excluded. Updates every {REFRESH_SECONDS} seconds.")
+
+
+def admin_page(conn):
+    if st.sidebar.radio("View", ["Live analytics", "Responses"]) == "Live analytics":
+        live_analytics(conn)
+        return
+
+    st.title("Collected responses")
+
+    row_count = cached_row_count(conn.engine)
+    st.metric("Trials stored", row_count)
+    st.dataframe(cached_summary(conn.engine), hide_index=True)
+
+    page_count = max(1, math.ceil(row_count / PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+    st.caption(f"Page {page} of {page_count}, most recent first. Counts refresh every minute.")
+    st.dataframe(cached_page(conn.engine, page - 1), hide_index=True)
@@ -0,0 +1,75 @@
+# Admission control for launch spikes.
+#
+# At most max_active participants per server process are in the study at a
+# time. Later arrivals wait on a light page that polls for their turn, and are
+# admitted in arrival order as slots free up: when a participant reaches the end
+# page, or after idle_timeout seconds without a rerun. Participants who are
+# already past the welcome page, or come back (their pid or Prolific ID has a
+# snapshot in the session store, which is only saved after admission), are never
+# sent back to the queue. A pid in the URL without a snapshot queues like anyone
+# else. Queued visitors are not restored until they are in.
+#
+# Metrics:
+#   app_admission_active           sessions holding a slot
+#   app_admission_waiting          sessions in the queue
+#   app_admission_wait_seconds     time from arrival to admission
+#   app_admission_admitted_total   sessions admitted from the queue
+#   app_admission_expired_total{state}  slots / queue places dropped for inactivity
+
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class AdmissionController:
+    def __init__(self, max_active, idle_timeout=900, poll_interval=5):
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._active = {}               # key -> last seen
+        self._waiting = OrderedDict()   # key -> [arrived, last seen], in arrival order
+
+    def admit(self, key, force=False):
+        # Returns (admitted, position in the queue); every call counts as activity
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._active or force:
+                self._waiting.pop(key, None)
+                self._active[key] = now
+            else:
+                self._waiting.setdefault(key, [now, now])[1] = now
+            self._admit_waiting(now)
+            position = 0 if key in self._active else list(self._waiting).index(key) + 1
+            self._publish()
+        return position == 0, position
+
+    def release(self, key):
+        with self._lock:
+            self._active.pop(key, None)
+            self._waiting.pop(key, None)
+            self._admit_waiting(time.monotonic())
+            self._publish()
+
+    def _admit_waiting(self, now):
+        while self._waiting and len(self._active) < self.max_active:
+            key, (arrived, _) = self._waiting.popitem(last=False)
+            self._active[key] = now
+            metrics.observe("app_admission_wait_seconds", now - arrived)
+            metrics.inc("app_admission_admitted_total")
+
+    def _expire(self, now):
+        for key in [key for key, seen in self._active.items() if now - seen > self.idle_timeout]:
+            del self._active[key]
+            metrics.inc("app_admission_expired_total", state="active")
+        # Someone who closed the waiting page stops polling
+        for key in [key for key, (_, seen) in self._waiting.items() if now - seen > 3 * self.poll_interval]:
+            del self._waiting[key]
+            metrics.inc("app_admission_expired_total", state="waiting")
+
+    def _publish(self):
+        metrics.set_gauge("app_admission_active", len(self._active))
+        metrics.set_gauge("app_admission_waiting", len(self._waiting))
@@ -0,0 +1,257 @@
+# Batch analysis of the judgments: accuracy, reliance on the AI and signal
+# detection measures, per group, with participant-level bootstrap CIs.
+#
+#     python analysis.py --url mysql+mysqlconnector://user:pw@host/db
+#     python analysis.py --parquet exports/ --by accuracy_condition,confidence_range --out results.csv
+#     python analysis.py --parquet exports/ --by study,accuracy_condition
+#
+# Trials are read as whole columns (from the trials table, or from the Parquet
+# files written by `python export.py trials`) and reduced to per-participant
+# sums and judgment histograms with np.bincount. Every measure is a function of
+# those sums, so a bootstrap sample is one matrix product of resampling weights
+# with them, and B samples for all participants of a group are computed at once.
+# Attention checks are left out.
+#
+# Measures, with "judged truthful" meaning a judgment >= 0 as for the AI
+# (trials.is_prediction_correct):
+#   accuracy          share of trials judged the right way
+#   ai_accuracy       share of trials where the shown AI judgment was right
+#   agreement         judgment on the same side as the AI (same sign, as in the dashboard)
+#   weight_of_advice  judgment / AI judgment, clipped to 0..1. The AI judgment is shown
+#                     before the participant's first judgment, so the scale midpoint
+#                     stands in for the initial estimate
+#   d_prime, criterion  signal = truthful statement, with the log-linear correction
+#   auc               area under the ROC curve of the -50..+50 judgments
+
+import argparse
+import csv
+import os
+from statistics import NormalDist
+
+import numpy as np
+
+from trials import is_prediction_correct
+
+COLUMNS = ["participant_id", "study", "accuracy_condition", "statement_condition", "confidence_range",
+           "ai_judgment", "participant_judgment", "correct_prediction"]
+GROUP_COLUMNS = ["study", "accuracy_condition", "confidence_range", "statement_condition"]
+MEASURES = ["accuracy", "ai_accuracy", "agreement", "weight_of_advice", "d_prime", "criterion", "auc"]
+
+# Judgments run from -50 to +50; histogram bin = judgment + SCALE_OFFSET
+SCALE_OFFSET = 50
+SCALE_BINS = 101
+
+# Per-participant sums, in this order
+SUMS = ["trials", "correct", "ai_correct", "agree", "woa", "woa_trials", "signal", "hits", "noise", "false_alarms"]
+
+# Bootstrap weights are drawn in blocks of at most this many samples x participants
+BOOTSTRAP_CELLS = 4_000_000
+
+_inverse_normal = np.vectorize(NormalDist().inv_cdf, otypes=[float])
+
+
+def load_database(engine, chunk_size=100_000):
+    # Read in keyset pages (trial_seq > last ORDER BY trial_seq LIMIT chunk_size) like export.py,
+    # since mysqlconnector has no server-side cursors; only the columns used here are read
+    import storage
+    from sqlalchemy import text
+
+    aliased = {"participant_id": "t", "study": "p", "accuracy_condition": "p"}
+    selected = ", ".join(f"{aliased.get(name, 't')}.{name}" for name in COLUMNS)
+    query = text(f"""
+        SELECT t.trial_seq, {selected}
+        FROM {storage.TRIALS_TABLE} t
+        JOIN {storage.PARTICIPANTS_TABLE} p ON p.participant_id = t.participant_id
+        WHERE t.trial_seq > :last
+        ORDER BY t.trial_seq
+        LIMIT :chunk_size
+    """)
+    chunks = []
+    last = 0
+    with engine.connect() as db:
+        while rows := db.execute(query, {"last": last, "chunk_size": chunk_size}).all():
+            chunks.append([np.array(column) for column in list(zip(*rows))[1:]])
+            last = rows[-1][0]
+    if not chunks:
+        return {name: np.empty(0) for name in COLUMNS}
+    return {name: np.concatenate([chunk[i] for chunk in chunks]) for i, name in enumerate(COLUMNS)}
+
+
+def load_parquet(path):
+    # A file or a directory of exported files
+    import pyarrow.dataset as ds
+
+    # Exports made before there were several studies have no study column
+    dataset = ds.dataset(path, format="parquet")
+    table = dataset.to_table(columns=[name for name in COLUMNS if name in dataset.schema.names])
+    data = {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+    data.setdefault("study", np.full(table.num_rows, "default"))
+    return data
+
+
+def prepare(data):
+    # Drops the attention checks and rows without a judgment; judgments as int, conditions as str
+    judgment = np.asarray(data["participant_judgment"], dtype=float)  # None / null -> nan
+    ai = np.asarray(data["ai_judgment"], dtype=float)
+    statement_condition = data["statement_condition"].astype(str)
+    keep = (statement_condition != "attention_check") & ~np.isnan(judgment) & ~np.isnan(ai)
+    prepared = {name: data[name][keep].astype(str) for name in COLUMNS
+                if name not in ("ai_judgment", "participant_judgment", "correct_prediction")}
+    prepared["participant_judgment"] = judgment[keep].astype(np.int64)
+    prepared["ai_judgment"] = ai[keep].astype(np.int64)
+    prepared["correct_prediction"] = np.asarray(data["correct_prediction"][keep], dtype=bool)
+    return prepared
+
+
+def participant_sums(participant_ids, statement_condition, judgment, ai_judgment, ai_correct):
+    # (participant count, sums: participants x SUMS, truthful and deceptive judgment histograms: participants x SCALE_BINS)
+    participants, codes = np.unique(participant_ids, return_inverse=True)
+    n = len(participants)
+    truthful = statement_condition == "truthful"
+    judged_truthful = judgment >= 0
+    nonzero_ai = ai_judgment != 0
+    woa = np.zeros(len(judgment))
+    woa[nonzero_ai] = np.clip(judgment[nonzero_ai] / ai_judgment[nonzero_ai], 0, 1)
+
+    columns = [
+        np.ones(len(judgment)),
+        is_prediction_correct(judgment, statement_condition),
+        ai_correct,
+        np.sign(judgment) == np.sign(ai_judgment),
+        woa,
+        nonzero_ai,
+        truthful,
+        truthful & judged_truthful,
+        ~truthful,
+        ~truthful & judged_truthful,
+    ]
+    sums = np.column_stack([np.bincount(codes, weights=column, minlength=n) for column in columns])
+
+    bins = codes * SCALE_BINS + np.clip(judgment + SCALE_OFFSET, 0, SCALE_BINS - 1)
+    signal_hist = np.bincount(bins[truthful], minlength=n * SCALE_BINS).reshape(n, SCALE_BINS)
+    noise_hist = np.bincount(bins[~truthful], minlength=n * SCALE_BINS).reshape(n, SCALE_BINS)
+    return n, sums, signal_hist, noise_hist
+
+
+def measures(sums, signal_hist, noise_hist):
+    # Works on one set of totals (SUMS,) or a stack of bootstrap totals (B, SUMS)
+    total = {name: sums[..., i] for i, name in enumerate(SUMS)}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hit_rate = (total["hits"] + 0.5) / (total["signal"] + 1)
+        false_alarm_rate = (total["false_alarms"] + 0.5) / (total["noise"] + 1)
+        z_hit, z_false_alarm = _inverse_normal(hit_rate), _inverse_normal(false_alarm_rate)
+
+        # P(truthful judged higher than deceptive) + half the ties, from the histograms
+        noise_below = np.cumsum(noise_hist, axis=-1) - noise_hist
+        auc = ((signal_hist * (noise_below + 0.5 * noise_hist)).sum(axis=-1)
+               / (signal_hist.sum(axis=-1) * noise_hist.sum(axis=-1)))
+        return {
+            "accuracy": total["correct"] / total["trials"],
+            "ai_accuracy": total["ai_correct"] / total["trials"],
+            "agreement": total["agree"] / total["trials"],
+            "weight_of_advice": total["woa"] / total["woa_trials"],
+            "d_prime": z_hit - z_false_alarm,
+            "criterion": -(z_hit + z_false_alarm) / 2,
+            "auc": auc,
+        }
+
+
+def roc_curve(signal_hist, noise_hist):
+    # (threshold, false alarm rate, hit rate) of "judged truthful when judgment >= threshold"
+    thresholds = np.arange(SCALE_BINS) - SCALE_OFFSET
+    hits = np.cumsum(signal_hist[::-1])[::-1] / max(signal_hist.sum(), 1)
+    false_alarms = np.cumsum(noise_hist[::-1])[::-1] / max(noise_hist.sum(), 1)
+    return thresholds, false_alarms, hits
+
+
+def bootstrap(sums, signal_hist, noise_hist, samples=2000, confidence=0.95, rng=None):
+    # Participants are resampled with replacement; weights[b, p] = times participant p is drawn in sample b
+    rng = rng if rng is not None else np.random.default_rng()
+    n = len(sums)
+    block = max(1, BOOTSTRAP_CELLS // n)  # samples per block, so the weight matrix stays small
+    totals = [[], [], []]
+    for start in range(0, samples, block):
+        size = min(block, samples - start)
+        draws = rng.integers(0, n, size=(size, n)) + np.arange(size)[:, None] * n
+        weights = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(float)
+        for total, values in zip(totals, (sums, signal_hist, noise_hist)):
+            total.append(weights @ values)
+    resampled = measures(*(np.concatenate(total) for total in totals))
+    tail = (1 - confidence) / 2 * 100
+    return {name: tuple(np.nanpercentile(values, [tail, 100 - tail])) for name, values in resampled.items()}
+
+
+def analyze(data, by=("accuracy_condition",), samples=2000, confidence=0.95, seed=None):
+    # One result row per group and measure: group values, measure, estimate, CI, participants, trials
+    data = prepare(data)
+    rng = np.random.default_rng(seed)
+    keys = np.column_stack([data[column] for column in by]) if by else np.full((len(data["participant_id"]), 1), "all")
+    groups, group_codes = np.unique(keys, axis=0, return_inverse=True)
+    group_codes = group_codes.ravel()
+
+    results, curves = [], {}
+    for index, group in enumerate(groups):
+        rows = group_codes == index
+        n, sums, signal_hist, noise_hist = participant_sums(
+            data["participant_id"][rows], data["statement_condition"][rows], data["participant_judgment"][rows],
+            data["ai_judgment"][rows], data["correct_prediction"][rows])
+        estimates = measures(sums.sum(axis=0), signal_hist.sum(axis=0), noise_hist.sum(axis=0))
+        intervals = bootstrap(sums, signal_hist, noise_hist, samples, confidence, rng) if samples else {}
+        for name in MEASURES:
+            low, high = intervals.get(name, (np.nan, np.nan))
+            results.append({**dict(zip(by or ["group"], map(str, group))), "measure": name, "estimate": float(estimates[name]),
+                            "ci_low": float(low), "ci_high": float(high),
+                            "participants": n, "trials": int(sums[:, 0].sum())})
+        curves[tuple(map(str, group))] = roc_curve(signal_hist.sum(axis=0), noise_hist.sum(axis=0))
+    return results, curves
+
+
+def _write_csv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy, AI reliance and signal detection measures per group.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--url", help="SQLAlchemy database URL")
+    source.add_argument("--parquet", help="trials export: a Parquet file or a directory of them")
+    parser.add_argument("--by", default="accuracy_condition",
+                        help=f"comma-separated grouping columns ({', '.join(GROUP_COLUMNS)}), or empty for one group")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="bootstrap samples (0 for none)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="level of the bootstrap intervals")
+    parser.add_argument("--seed", type=int, help="random seed of the bootstrap")
+    parser.add_argument("--out", help="also write the results to this CSV file")
+    parser.add_argument("--roc", help="write the ROC points of each group to this CSV file")
+    args = parser.parse_args()
+
+    by = tuple(column for column in args.by.split(",") if column)
+    if not set(by) <= set(GROUP_COLUMNS):
+        parser.error(f"--by takes {', '.join(GROUP_COLUMNS)}")
+    if args.url:
+        from sqlalchemy import create_engine
+        data = load_database(create_engine(args.url))
+    else:
+        data = load_parquet(args.parquet)
+
+    results, curves = analyze(data, by, args.bootstrap, args.confidence, args.seed)
+    if not results:
+        raise SystemExit("No trials to analyze")
+
+    group_columns = list(by or ["group"])
+    print(f"{' / '.join(group_columns):<40}{'measure':<18}{'estimate':>9}  {'CI':<17}{'participants':>13}{'trials':>8}")
+    for row in results:
+        group = " / ".join(str(row[column]) for column in group_columns)
+        interval = f"[{row['ci_low']:.3f}, {row['ci_high']:.3f}]" if args.bootstrap else ""
+        print(f"{group:<40}{row['measure']:<18}{row['estimate']:>9.3f}  {interval:<17}{row['participants']:>13}{row['trials']:>8}")
+
+    if args.out:
+        _write_csv(args.out, results)
+    if args.roc:
+        _write_csv(args.roc, [{**dict(zip(group_columns, group)), "threshold": int(threshold),
+                               "false_alarm_rate": float(false_alarm), "hit_rate": float(hit)}
+                              for group, curve in curves.items() for threshold, false_alarm, hit in zip(*curve)])
+    if args.out or args.roc:
+        print("Written: " + ", ".join(os.path.abspath(path) for path in (args.out, args.roc) if path))
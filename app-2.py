@@ -1,27 +1,109 @@
 import streamlit as st
 import time
 import datetime
-import pandas as pd 
-import numpy as np
 import random
+import os
 import uuid 
-from streamlit.components.v1 import html
-
-
-conn = st.connection("sql")
-df = conn.query("SELECT * FROM Sheet1")
-
-
-if 'experiment_responses' not in st.session_state:
-        st.session_state.experiment_responses = pd.DataFrame()
-
-# Load the dataset (assuming it's in the same directory)
-@st.cache_data(ttl=1800)  # Cache the data for 60 seconds
-def load_statements():
-    return pd.read_csv("hippocorpus_test_set.csv", sep=";")
-
-# Define progress bar
-total_steps = 22
+import logging
+
+# Only lightweight modules here. The data stack (numpy, SQLAlchemy and the study modules
+# built on them: trials, plans, storage, write_queue) and the database connection are
+# loaded on first use, so a fresh server process serves the intro pages without them
+import admission
+import client_timing
+import intro_bundle
+import label_html
+import metrics
+import session_store
+import studies
+
+
+# Every session shares one SQLAlchemy engine (st.connection is cached per process),
+# so reads and writes reuse pooled connections instead of reconnecting on each Submit.
+# Pool sizes and timeouts can be overridden in the [db_pool] section of .streamlit/secrets.toml
+DB_POOL_DEFAULTS = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+
+def get_connection():
+    pool_settings = {**DB_POOL_DEFAULTS, **st.secrets.get("db_pool", {})}
+    return st.connection("sql", **pool_settings)
+
+# Create the response tables, their indexes and the Sheet1 view once per server process
+@st.cache_resource
+def prepare_responses_table():
+    import storage
+    return storage.ensure_schema(get_connection().engine)
+
+def db_engine():
+    prepare_responses_table()
+    return get_connection().engine
+
+# Background writer shared by all sessions, started by the first Submit (it then also replays
+# any journal a previous process left behind); settings in the [write_queue] section of the secrets.
+# It creates the tables itself, so a database that is down only sends rows to the journal
+def write_queue_settings():
+    settings = dict(st.secrets.get("write_queue", {}))
+    journal_path = settings.pop("journal_path", os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_journal.jsonl"))
+    return journal_path, settings
+
+@st.cache_resource
+def get_response_writer():
+    from write_queue import WriteBehindQueue
+    journal_path, settings = write_queue_settings()
+    return WriteBehindQueue(get_connection().engine, journal_path, **settings)
+
+def submit_response(row):
+    import write_queue
+    try:
+        writer = get_response_writer()
+    except Exception as e:
+        # No writer in this process for now: the row waits in the journal for the next one that starts
+        logging.getLogger(__name__).error("Could not start the response writer: %s", e)
+        write_queue.append_to_journal(write_queue.journal_path_for(write_queue_settings()[0]), [row])
+        return
+    writer.submit(row)
+
+# When trial rows are stored, set in the [persistence] section of the secrets:
+#   "per_trial"      - each Submit queues its row on the background writer
+#   "end_of_session" - rows stay in the session (checkpointed by the session store after every
+#                      Submit) and the whole session is committed in one transaction at Submit Feedback
+persistence_mode = st.secrets.get("persistence", {}).get("mode", "per_trial")
+
+# Metrics export and sampled profiling; configured in the [metrics] section of the secrets
+@st.cache_resource
+def start_metrics_export():
+    settings = st.secrets.get("metrics", {})
+    if "port" in settings:
+        metrics.start_http_server(int(settings["port"]), settings.get("host", "127.0.0.1"))
+    if "log_path" in settings:
+        metrics.start_log_exporter(settings["log_path"], interval=settings.get("log_interval", 60))
+    return dict(settings)
+
+metrics_settings = start_metrics_export()
+
+
+# Study definitions (see studies.py), read once per server process
+@st.cache_resource
+def get_studies():
+    return studies.load_studies()
+
+# The memory-mapped statement store of a stimulus file, shared by all sessions of every study
+# that uses it; reopening it after the ttl costs next to nothing
+@st.cache_resource(ttl=1800)
+def load_corpus(stimuli_path, attention_checks):
+    import stimuli
+    return stimuli.open_store(stimuli_path, attention_checks=[stimuli.attention_check(*check) for check in attention_checks])
+
+# A study with its corpus and the per-range index its plans are drawn from
+@st.cache_resource(ttl=1800)
+def load_study(name):
+    study = get_studies()[name]
+    return studies.compile_study(study, load_corpus(study.stimuli, study.attention_checks))
 
 def update_progress():
      if 'current_step' not in st.session_state:
@@ -37,14 +119,25 @@ def show_progress_bar():
         st.session_state.current_step = 0
         st.progress(0)
 
+# Confirmation left by a button handler before st.rerun(); the toast stays on
+# screen for a few seconds on the client without holding the server
+def show_confirmation():
+    if 'confirmation' in st.session_state:
+        st.toast(st.session_state.pop('confirmation'), icon="✅")
+
+def get_scroller():
+    # Runs in the app page itself, no iframe. Registered on every run: the registry belongs to the
+    # Streamlit runtime rather than the process, and registering the same definition again is a no-op
+    return st.components.v2.component("scroll_to_top", js="""
+        export default function () {
+            document.querySelector('section.main')?.scrollTo(0, 0);
+        }
+    """)
+
 def scroll_to_top():
-    # Javascript to scroll to top of page
-    js = """
-        <script>
-            window.parent.document.querySelector('section.main').scrollTo(0, 0);
-        </script>
-    """
-    html(js)
+    # Mounted again at every progress step, so each new page or trial starts at the top
+    with metrics.timed("app_phase_seconds", phase="render_scroll"):
+        get_scroller()(key=f"scroll_to_top_{st.session_state.current_step}")
 
 # Initialize progress tracking
 if 'current_step' not in st.session_state:
@@ -52,11 +145,99 @@ if 'current_step' not in st.session_state:
 
 # Retrieve Prolific ID from query parameters
 if 'prolific_id' not in st.session_state:
-    st.session_state.prolific_id = st.query_params.get("PROLIFIC_PID", ["no_prolific_id"])  
+    st.session_state.prolific_id = st.query_params.get("PROLIFIC_PID", "no_prolific_id")  
 
-# Initialize participant ID if it doesn't exist
+# Initialize participant ID if it doesn't exist. It is put in the URL once the participant
+# is admitted (see below), so that they can also be resumed after a reconnect without a Prolific ID
 if 'participant_id' not in st.session_state:
-    st.session_state.participant_id = str(uuid.uuid4())
+    st.session_state.participant_id = st.query_params.get("pid") or str(uuid.uuid4())
+
+# Page Navigation Logic
+if 'page' not in st.session_state:
+    st.session_state.page = 'welcome'
+
+# Shared session storage (several app processes, resume on reconnect);
+# configured in the [session_store] section of the secrets
+@st.cache_resource
+def get_session_backend():
+    settings = dict(st.secrets.get("session_store", {}))
+    if persistence_mode == "end_of_session" and settings.get("backend", "none") == "none":
+        # The snapshot is the only per-trial checkpoint in this mode, so it has to be stored somewhere;
+        # a local file, so that the study database still sees one write per participant
+        settings["backend"] = "sqlite"
+    return session_store.make_backend(settings, db_engine)
+
+session_backend = get_session_backend()
+if st.session_state.prolific_id != "no_prolific_id":
+    session_key = st.session_state.prolific_id
+else:
+    session_key = st.session_state.participant_id
+
+# Admission control for launch spikes; enabled by max_active in the [admission] section of the secrets
+@st.cache_resource
+def get_admission_controller():
+    settings = dict(st.secrets.get("admission", {}))
+    if "max_active" not in settings:
+        return None
+    return admission.AdmissionController(**settings)
+
+admission_controller = get_admission_controller()
+
+def is_returning():
+    # Only someone who was admitted before has a snapshot in the session store; a pid or Prolific ID
+    # in the URL alone proves nothing. Looked up once per session, and only when the URL names someone
+    if 'returning' not in st.session_state:
+        named = st.query_params.get("pid") or st.session_state.prolific_id != "no_prolific_id"
+        st.session_state.returning = bool(named) and session_backend.load(session_key) is not None
+    return st.session_state.returning
+
+def is_admitted():
+    if admission_controller is None:
+        return True
+    if st.session_state.page == 'end':
+        admission_controller.release(session_key)
+        return True
+    # Only new arrivals queue. Anyone past the welcome page keeps going, and so does someone coming back
+    admitted, _ = admission_controller.admit(session_key, force=st.session_state.page != 'welcome' or is_returning())
+    return admitted
+
+def is_admin_request():
+    # admin (and pandas with it) is only imported when a token is given
+    if not st.query_params.get("admin"):
+        return False
+    import admin
+    return admin.is_admin(st.query_params.get("admin"))
+
+# Queued visitors are not restored and get no pid in the URL until they are admitted
+admin_request = is_admin_request()
+admitted = admin_request or is_admitted()
+
+if admitted:
+    if st.query_params.get("pid") != st.session_state.participant_id:
+        st.query_params["pid"] = st.session_state.participant_id
+
+    with metrics.timed("app_phase_seconds", phase="session_store"):
+        if 'session_restored' not in st.session_state:
+            saved_state = session_backend.load(session_key)
+            if saved_state:
+                session_store.restore(st.session_state, saved_state)
+            st.session_state.session_restored = True
+            st.session_state.saved_checkpoint = session_store.checkpoint(st.session_state)
+        else:
+            # Progress made by the previous run (pages end with st.rerun(), so this is the first chance to save it),
+            # saved on page changes and trial submits only
+            checkpoint = session_store.checkpoint(st.session_state)
+            if checkpoint != st.session_state.get('saved_checkpoint'):
+                session_backend.save(session_key, session_store.snapshot(st.session_state))
+                st.session_state.saved_checkpoint = checkpoint
+
+# Study of this participant, from ?study=<name> in their link; kept for the whole session
+if st.session_state.get('study') not in get_studies():
+    st.session_state.study = studies.select(get_studies(), st.query_params.get("study"))
+study = get_studies()[st.session_state.study]
+
+# Define progress bar: seven intro steps, the trials, final questions, feedback and the end page
+total_steps = study.trial_count + 10
 
 # For example page
 # Initialize session state to track the sub-page of the example
@@ -78,32 +259,14 @@ def go_to_previous_page():
         st.session_state.example_sub_page -= 1
         st.rerun()
 
-# Define now the elements to display Confidence later on (this will avoid repetitions later on):
-labels = ["Very confident",
-            "Confident",
-            "Moderately confident",
-            "Poorly confident", 
-            "Indecisive",
-            "Poorly confident",
-            "Moderately confident",
-            "Confident",
-            "Very confident"]
-
-style = "font-size: 12px; text-align: center;"
-
-def display_confidence_labels(labels, style):
-    col1, col2, col3, col4, col5, col6, col7, col8, col9 = st.columns([1, 1, 1, 1, 1.5, 1, 1, 1, 1])
-    for col, label in zip([col1, col2, col3, col4, col5, col6, col7, col8, col9], labels):
-            col.markdown(f"<div style='{style} color: grey'>{label}</div>", unsafe_allow_html=True)
-       
-# Define now the elements to display Truthful-Deceptive labels later on (this will avoid repetitions later on):
+# Confidence labels and Truthful-Deceptive legend under the sliders: prebuilt once per process
+# in label_html and emitted as one markdown block each
+def display_confidence_labels():
+    with metrics.timed("app_phase_seconds", phase="render_labels"):
+        st.markdown(label_html.CONFIDENCE_LABELS_HTML, unsafe_allow_html=True)
+
 def display_truthful_deceptive_labels():
-    space = st.columns(1)
-    col1, col2, col3 = st.columns([1, 6, 1])
-    with col1:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Deceptive</strong></p>", unsafe_allow_html=True)
-    with col3:
-        st.markdown("<p style='text-align: right; color: grey; font-size: 0.9em;'><strong>Truthful</strong></p>", unsafe_allow_html=True)
+    st.markdown(label_html.TRUTHFUL_DECEPTIVE_HTML, unsafe_allow_html=True)
 
 ####################################################################################################################
 
@@ -116,7 +279,6 @@ def welcome_page():
     st.write("""In this study, we are investigating how people make decisions when evaluating the veracity of statements. 
              We will now give you detailed instructions. **Please read them carefully.**
              \nOnce you complete the experiment, you will be redirected to Prolific.""")
-    st.dataframe(df)
     
     if st.button("Next"):
         update_progress()
@@ -129,37 +291,24 @@ def consent_page():
 
     st.title("Informed Consent")
 
-    st.write("This study is conducted by researchers at Tilburg University (The Netherlands)")
-    st.write("Name and email address of the principal investigator: Dr Bennett Kleinberg, bennett.kleinberg@tilburguniversity.edu")
-    st.markdown(
-    """
-    The study was reviewed and approved by the university’s ethics committee.
-    Please proceed if you agree to the following:
-
-    - I confirm that I have read and understood the information provided for this study.
-    - I understand that my participation is voluntary.
-    - I understand that I remain fully anonymous, and that I will not be identifiable in any publications or reports on the results of this study.
-    - I understand that the data collected in this survey might be made publicly available. I know that no personal information whatsoever will be included in this dataset and that my anonymous research data can be stored for the period of 10 years.
-    - I understand that the results of this survey will be reported in academic publications or conference presentations.
-    - I understand that I will not benefit financially from this study or from any possible outcome it may result in in the future.
-    - I understand that I will be compensated for participation in this study as detailed in the task description on Prolific.
-    - I am aware of who I should contact if I wish to lodge a complaint or ask a question.
-    """, 
-    unsafe_allow_html=True)
-
-    st.write("""Please click on "Accept" if you want to give your consent and proceed with the experiment.
-              Otherwise, click  on "Deny" and the experiment ends.""")
+    for line in intro_bundle.CONSENT_RESEARCHERS:
+        st.write(line)
+    st.markdown(intro_bundle.CONSENT_APPROVAL + "\n\n" + "\n".join(f"- {item}" for item in intro_bundle.CONSENT_ITEMS))
+
+    st.write(intro_bundle.CONSENT_PROMPT)
     
     col1, col2, col3 = st.columns([1,6,1])
     with col1:
         if st.button("Accept"):
             st.session_state.consent_data = "Accepted"
+            st.session_state.consent_time = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
             update_progress()
             st.session_state.page = 'instructions'
             st.rerun()
     with col3:
         if st.button("Deny"):
             st.session_state.consent_data = "Denied"
+            st.session_state.consent_time = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
             update_progress()
             st.session_state.page = 'end'
             st.rerun()
@@ -168,7 +317,7 @@ def instructions_page():
     show_progress_bar()
 
     st.title("Instructions")
-    st.write(":book: In this experiment, you will read **twelve** short statements about past experiences that are either truthful or lies.")
+    st.write(f":book: In this experiment, you will read **{study.trial_count_text}** short statements about past experiences that are either truthful or lies.")
     st.write("Your task is to guess whether each statement is truthful :white_check_mark: or a lie :lying_face:")
     st.write("These statements were randomly selected from a larger dataset where half of all statements are truthful, and half of them are lies.")
 
@@ -206,7 +355,7 @@ def example_page():
         
         st.slider("AI Judgment:", min_value=-50, max_value=+50, value=35, step=10, disabled=True) 
         st.columns(1)
-        display_confidence_labels(labels, style) # Display confidence labels 
+        display_confidence_labels() # Display confidence labels 
         display_truthful_deceptive_labels()  # Display true-false labels 
         
         st.write("""**Explanations:** This slider shows you that the more the judgment is close to **+50**, the more the AI lie-detector is **confident** that the statement is **truthful**.
@@ -221,7 +370,7 @@ def example_page():
                     This is an example, so your choices have no consequences on this page.""")
 
         st.slider("Your judgment", min_value=-50, max_value=+50, value=0, step=1, disabled=False)
-        display_confidence_labels(labels, style) # Display confidence labels 
+        display_confidence_labels() # Display confidence labels 
         display_truthful_deceptive_labels() # Display true-false labels 
 
         st.write("""**Explanations:** As before, the more your judgment is close to **+50**, the more you are **confident** that the statement is **truthful**.
@@ -247,108 +396,149 @@ def example_page():
                 update_progress()
                 go_to_next_page()
                
-def insert_attention_checks(statements):
-    # Create attention check statements
-    attention_check_1 = pd.DataFrame([{
-        'truth-dec_pairID': 'attention_check_1',
-        'text': """This is an attention check and serves to validate your participation. Please put the slider at the position -20. The rest of this statement is just a placeholder.
-                Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.
-                Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat.
-                Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur.
-                Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum.""",
-        'condition': 'attention_check',
-        'confidence': -20
-    }])
-    attention_check_2 = pd.DataFrame([{
-        'truth-dec_pairID': 'attention_check_2',
-        'text': """This is an attention check and serves to validate your participation. Please put the slider at the position 33. The rest of this statement is just a placeholder.
-                Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.
-                Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat.
-                Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur.
-                Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum.""",
-        'condition': 'attention_check',
-        'confidence': 33
-    }])
-
-    # Insert attention checks at random positions
-    statements.insert(random.randint(0, len(statements)), attention_check_1)
-    statements.insert(random.randint(0, len(statements)), attention_check_2)
-    return statements 
+# The intro pages above as one client-side bundle (see intro_bundle.py), which reports
+# back once with the consent; enabled by client_side in the [intro] section of the secrets
+intro_client_side = st.secrets.get("intro", {}).get("client_side", False)
+INTRO_PAGES = ('welcome', 'consent', 'instructions', 'example')
+
+def get_intro_bundle():
+    # Registered on every run, like the scroller
+    return st.components.v2.component("intro_bundle", html=intro_bundle.INTRO_HTML,
+                                      css=intro_bundle.INTRO_CSS, js=intro_bundle.INTRO_JS)
+
+def intro_page():
+    # A participant resumed in the middle of the intro starts again from the page they were on
+    screen = st.session_state.page
+    if screen == 'example':
+        screen = f"example_{st.session_state.example_sub_page}"
+    result = get_intro_bundle()(key="intro_bundle",
+                                data={'screen': screen, 'step': st.session_state.current_step, 'total_steps': total_steps,
+                                      'trial_count': study.trial_count_text,
+                                      'consent': st.session_state.get('consent_data')},
+                                on_done_change=lambda: None)
+
+    outcome = intro_bundle.read_outcome(result.done)
+    if outcome is None:
+        return
+    st.session_state.consent_data = outcome['consent']
+    st.session_state.consent_time = outcome['consented_at']
+    st.session_state.current_step = min(total_steps, st.session_state.current_step + outcome['steps'])
+    metrics.observe("app_intro_seconds", outcome['intro_ms'] / 1000)
+    st.session_state.page = 'experiment' if outcome['consent'] == "Accepted" else 'end'
+    st.rerun()
+
+# Pool of pre-generated, counterbalanced plans (see plans.py)
+@st.cache_resource
+def prepare_plans_table():
+    import plans
+    plans.ensure_plans_table(db_engine())
+
+# Statement texts are stored once, in the statements table; trials only reference them
+@st.cache_resource
+def prepare_statements_table(version, _corpus):
+    rows = (_corpus.row(position) for position in range(len(_corpus)))
+    import storage
+    return storage.write_statements(db_engine(), ((row['truth-dec_pairID'], row['condition'], row['text']) for row in rows))
+
+def assign_plan(compiled):
+    import plans
+    from sqlalchemy.exc import SQLAlchemyError
+    # Next plan from the pool, or a freshly drawn one when the pool is empty or unreachable
+    assignment = None
+    try:
+        with metrics.timed("app_phase_seconds", phase="plan_claim"):
+            prepare_plans_table()
+            assignment = plans.claim_plan(db_engine(), compiled.plan_version, st.session_state.participant_id)
+    except SQLAlchemyError as e:
+        logging.getLogger(__name__).warning("Could not claim a trial plan: %s", e)
+    if assignment is None:
+        metrics.inc("app_plans_drawn_locally_total")
+        assignment = plans.draw_plan(compiled.range_index, compiled.attention_positions,
+                                     accuracy_levels=study.accuracy_levels)
+    return assignment
+
+def trial_row(corpus, index):
+    # Sheet1 row of a submitted trial, rebuilt from the plan and the recorded responses
+    trial_plan = st.session_state.trial_plan
+    trial_responses = st.session_state.trial_responses
+    statement_row = corpus.row(trial_plan.positions[index])
+    return {
+        'date': datetime.date.fromtimestamp(trial_responses.start_times[index]).strftime("%Y-%m-%d"),
+        'study': study.name,
+        'accuracy_condition': st.session_state.accuracy_condition,
+        'prolific_id': st.session_state.prolific_id,
+        'participant_id': st.session_state.participant_id,
+        'consent': st.session_state.consent_data,
+        'consent_time': st.session_state.get('consent_time'),
+        'statement_id': statement_row['truth-dec_pairID'],
+        'text': statement_row['text'],
+        'statement_condition': statement_row['condition'],
+        'confidence_range': statement_row['confidence_range'],
+        'duration': trial_responses.duration_ns[index] / 1e9,
+        'duration_ns': int(trial_responses.duration_ns[index]),
+        'client_duration_us': int(trial_responses.client_duration_us[index]) if trial_responses.client_duration_us[index] >= 0 else None,
+        'correct_prediction': bool(trial_plan.correct_predictions[index]),
+        'ai_judgment': int(trial_plan.ai_judgments[index]),
+        'participant_judgment': int(trial_responses.participant_judgments[index]),
+    }
+
+# Reading times measured in the browser as well, enabled by client = true in the [timing] section of the secrets
+client_timing_enabled = st.secrets.get("timing", {}).get("client", False)
+
+def get_reading_timer():
+    # Registered on every run, like the scroller above
+    return st.components.v2.component("reading_timer", js=client_timing.TIMER_JS)
+
+def trial_payload(corpus, trial_plan, index):
+    # What the page shows for a trial: the statement text and the (possibly flipped) AI judgment.
+    # Built on every run from the memory-mapped store; the session only keeps the plan's row positions
+    statement_row = corpus.row(trial_plan.positions[index])
+    return {
+        'text': statement_row['text'],
+        'ai_judgment': int(trial_plan.ai_judgments[index]),
+    }
 
 def experiment_page():
+    import trials
+    from sqlalchemy.exc import SQLAlchemyError
+
     scroll_to_top()
+    show_confirmation()
 
    # Initialize session state attributes if not already initialized
     if 'current_index' not in st.session_state:
         st.session_state.current_index = 0
-    if 'accuracy_condition' not in st.session_state:
-        random.seed(st.session_state.participant_id)  # Set a different seed each time
-        conditions = random.choice(["accuracy_low", "accuracy_high"])
-        st.session_state.accuracy_condition = conditions
-    if 'start_time' not in st.session_state:
-        st.session_state.start_time = time.time()
-    if f'start_time_{st.session_state.current_index}' not in st.session_state:
-        st.session_state[f'start_time_{st.session_state.current_index}'] = time.time()
     if 'slider_moved' not in st.session_state:
         st.session_state.slider_moved = False
 
-    def adjust_ai_confidence(confidence, condition):
-        if condition == "accuracy_low":
-            if random.random() > 0.54:
-                confidence = -confidence  # Flip the confidence
-        elif condition == "accuracy_high":
-            if random.random() > 0.89:
-                confidence = -confidence  # Flip the confidence
-        return confidence
-
-    def is_prediction_correct(confidence, statement_condition):
-        if statement_condition == "truthful" and confidence >= 0:
-            return True
-        elif statement_condition == "deceptive" and confidence < 0:
-            return True
-        return False
-
-    # Load dataset and select 10 random statements once per session
-    if 'statements' not in st.session_state:
-        data = load_statements()
-        selected_statements = []
-        for unique_range in range(1, 11):
-            statements_in_range = data[data['range'] == unique_range]
-            if not statements_in_range.empty:
-                selected_statement = statements_in_range.sample(1)
-                selected_statements.append(selected_statement)
-        
-        # Insert attention checks
-        selected_statements = insert_attention_checks(selected_statements)
-
-        st.session_state.statements = pd.concat(selected_statements).sample(frac=1).reset_index(drop=True)
+    # Assign the condition, one statement per range, the attention checks and the AI flips once per session.
+    # The plan refers to rows of the shared corpus and already holds the (possibly flipped) AI judgments
+    with metrics.timed("app_phase_seconds", phase="data_load"):
+        compiled = load_study(study.name)
+        corpus = compiled.corpus
+    if 'trial_plan' not in st.session_state:
+        try:
+            prepare_statements_table(corpus.version, corpus)
+        except SQLAlchemyError as e:
+            logging.getLogger(__name__).warning("Could not store the statement texts: %s", e)
+        st.session_state.accuracy_condition, positions, flips = assign_plan(compiled)
+        st.session_state.trial_plan = trials.trial_plan_with_flips(corpus, positions, flips)
+        st.session_state.trial_responses = trials.TrialResponses.empty(len(positions))
         st.session_state.current_index = 0  # Initialize index for the first statement
         st.session_state.submitted = False 
-    
-    statement_number = st.session_state.current_index + 1 
 
-    # Get current statement based on the index
-    statement_row = st.session_state.statements.iloc[st.session_state.current_index]
-    
-    # Store statement details in session state for consistent access
-    st.session_state.statement_id = statement_row['truth-dec_pairID']
-    st.session_state.statement_text = statement_row['text']
-    st.session_state.statement_condition = statement_row['condition']
-    st.session_state.statement_confidence_range = statement_row['confidence_range']
+    trial_plan = st.session_state.trial_plan
+    trial_responses = st.session_state.trial_responses
+    current_index = st.session_state.current_index
 
-    
-    # Adjust AI confidence based on experiment condition
-    if f'ai_judgment_{st.session_state.current_index}' not in st.session_state:
-        adjusted_confidence = adjust_ai_confidence(int(statement_row['confidence']), st.session_state.accuracy_condition)
-        st.session_state[f'ai_judgment_{st.session_state.current_index}'] = adjusted_confidence
-        st.session_state[f'correct_prediction_{st.session_state.current_index}'] = is_prediction_correct(adjusted_confidence, statement_row['condition'])
-    
-    # Retrieve the adjusted AI confidence and prediction correctness
-    ai_judgment = st.session_state[f'ai_judgment_{st.session_state.current_index}']
-    correct_prediction = st.session_state[f'correct_prediction_{st.session_state.current_index}']
+    statement_number = current_index + 1 
+
+    # Current statement and adjusted AI confidence
+    payload = trial_payload(corpus, trial_plan, current_index)
+    ai_judgment = payload['ai_judgment']
 
     # Display the statement counter and progress bar
-    total_statements = len(st.session_state.statements)    
+    total_statements = len(trial_plan)
     st.write(f"**Statement {statement_number} of {total_statements}**.")
     show_progress_bar()
 
@@ -357,120 +547,86 @@ def experiment_page():
     
     # Display the statement
     st.write("Please read the following statement carefully:")
-    st.write(f"**Statement {statement_number}**: \n{st.session_state.statement_text}")
+    st.write(f"**Statement {statement_number}**: \n{payload['text']}")
 
     # Initialize trial-specific keys
-    participant_judgment_key = f'participant_judgment_{st.session_state.current_index}'
+    participant_judgment_key = f'participant_judgment_{current_index}'
 
     # Display condition-based AI slider message
-    if st.session_state.accuracy_condition == 'accuracy_low':
-        st.write(":robot_face: **An AI-based lie detector with 54% accuracy has provided the following judgment for this statement** :arrow_down:")
-    else:
-        st.write(":robot_face: **An AI-based lie detector with 89% accuracy has provided the following judgment for this statement** :arrow_down:")
-
-    if st.session_state.statement_condition == 'attention_check':
-        ai_judgment = int(statement_row['confidence'])  # Set AI judgment to the specified value for attention checks
-    else:
-        ai_judgment = st.session_state[f'ai_judgment_{st.session_state.current_index}']
+    accuracy_label = study.condition(st.session_state.accuracy_condition).label
+    st.write(f":robot_face: **An AI-based lie detector with {accuracy_label} accuracy has provided the following judgment for this statement** :arrow_down:")
 
     # AI's interactive slider
     st.slider("AI Judgment:", min_value=-50, max_value=+50, value=ai_judgment, step=1, disabled=True)
-    display_confidence_labels(labels, style)  # Display confidence labels 
+    display_confidence_labels()  # Display confidence labels 
     display_truthful_deceptive_labels() # Display true-false labels 
 
     # Participant's interactive slider
     st.write(":sleuth_or_spy: **Please rate the statement** :arrow_down:")
 
-    def slider_callback():
-        st.session_state.slider_moved = True
+    # Moving the slider reruns only this part of the page, not the whole script
+    @st.fragment
+    def judgment_and_submit():
+        metrics.inc("app_fragment_reruns_total", fragment="judgment")
 
-    if participant_judgment_key not in st.session_state:
-        st.session_state[participant_judgment_key] = 0  # Initialize to default
+        def slider_callback():
+            st.session_state.slider_moved = True
 
-    participant_judgment = st.slider("Your Judgment:", 
-                                    min_value=-50, 
-                                    max_value=+50, 
-                                    value=st.session_state[participant_judgment_key], 
-                                    step=1, 
-                                    key=participant_judgment_key,
-                                    on_change=slider_callback)                       
-    
-    display_confidence_labels(labels, style)   # Display confidence labels 
-    display_truthful_deceptive_labels() # Display true-false labels
-    
-    # Submit Button Logic
-    if st.button("Submit"):
-        if not st.session_state.slider_moved:
-            st.warning("Please move the slider!", icon="⚠️")
-            return
-
-        duration = time.time() - st.session_state[f'start_time_{st.session_state.current_index}']
-        current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-        response_data = pd.DataFrame(
-            [
-                {
-                    'date': current_date,
-                    'accuracy_condition': st.session_state.accuracy_condition,
-                    'prolific_id': st.session_state.prolific_id,
-                    'participant_id': st.session_state.participant_id,
-                    'consent': st.session_state.consent_data,
-                    'statement_id': st.session_state.statement_id,
-                    'text': st.session_state.statement_text,
-                    'statement_condition': st.session_state.statement_condition,
-                    'confidence_range': st.session_state.statement_confidence_range,
-                    'duration': duration,
-                    'correct_prediction': correct_prediction,
-                    'ai_judgment': ai_judgment,
-                    'participant_judgment': participant_judgment,
-                }
-            ]
-        )
-
-        st.session_state.experiment_responses = pd.concat([st.session_state.experiment_responses, response_data], ignore_index=True)
-
-        # Database Insertion
-        conn = get_connection()
-        if conn:
-            try:
-                with conn.cursor() as cursor:
-                    for index, row in st.session_state.experiment_responses.iterrows():
-                        query = """
-                            INSERT INTO Sheet1 (date, accuracy_condition, prolific_id, participant_id, consent, statement_id, text, statement_condition, confidence_range, duration, correct_prediction, ai_judgment, participant_judgment)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """
-                        values = (
-                            row['date'], row['accuracy_condition'], row['prolific_id'],
-                            row['participant_id'], row['consent'], row['statement_id'],
-                            row['text'], row['statement_condition'], row['confidence_range'],
-                            row['duration'], row['correct_prediction'], row['ai_judgment'],
-                            row['participant_judgment']
-                        )
-                        cursor.execute(query, values)
-                    conn.commit()
-                st.success("Data successfully saved to database!") # add success message
-            except mysql.connector.Error as e:
-                st.error(f"Error inserting data into database: {e}")
-                conn.rollback()
-            finally:
-                conn.close()
-
-        st.session_state.submitted = True
-        st.success("Your judgment has been recorded!")
-        time.sleep(2)
-        update_progress()
+        if participant_judgment_key not in st.session_state:
+            st.session_state[participant_judgment_key] = 0  # Initialize to default
 
-        if st.session_state.current_index < len(st.session_state.statements) - 1:
-            st.session_state.current_index += 1
-            st.session_state.submitted = False
-            st.session_state.slider_moved = False
-            st.rerun()
-        else:
-            st.session_state.page = 'final_questions'  
-            st.rerun()
+        participant_judgment = st.slider("Your Judgment:", 
+                                        min_value=-50, 
+                                        max_value=+50, 
+                                        value=st.session_state[participant_judgment_key], 
+                                        step=1, 
+                                        key=participant_judgment_key,
+                                        on_change=slider_callback)                       
+        
+        display_confidence_labels()   # Display confidence labels 
+        display_truthful_deceptive_labels() # Display true-false labels
+
+        # Submit Button Logic
+        if st.button("Submit"):
+            if not st.session_state.slider_moved:
+                st.warning("Please move the slider!", icon="⚠️")
+                return
+
+            client_duration_us = client_timing.read_duration_us(st.query_params.get(client_timing.QUERY_PARAM), trial_key)
+            if client_timing.QUERY_PARAM in st.query_params:
+                del st.query_params[client_timing.QUERY_PARAM]
+            trial_responses.record(current_index, participant_judgment, time.perf_counter_ns(), client_duration_us)
+
+            # Database Insertion: queued and written in the background, or left to the
+            # end of the session (the session snapshot saved on the next run is the checkpoint)
+            if persistence_mode == "per_trial":
+                submit_response(trial_row(corpus, current_index))
+
+            st.session_state.submitted = True
+            # Shown by the next run, so the script thread is released right away
+            st.session_state.confirmation = "Your judgment has been recorded!"
+            update_progress()
+
+            if current_index < len(trial_plan) - 1:
+                st.session_state.current_index += 1
+                st.session_state.submitted = False
+                st.session_state.slider_moved = False
+            else:
+                st.session_state.page = 'final_questions'  
+            st.rerun(scope="app")
+
+    trial_key = f"{st.session_state.participant_id}-{current_index}"
+    judgment_and_submit()
+
+    # The trial counts as shown once all of it has been sent; later reruns of the same trial keep this start
+    trial_responses.start(current_index, time.perf_counter_ns(), time.time())
+    if client_timing_enabled:
+        # One mount per trial, so the script runs again with the new key
+        get_reading_timer()(key=f"reading_timer_{current_index}", data={'trial_key': trial_key})
 
 def final_questions():
     scroll_to_top()
+    show_confirmation()
     show_progress_bar()
         
     if 'attention_check_accuracy_selected' not in st.session_state:
@@ -482,84 +638,74 @@ def final_questions():
     if 'ML_familiarity_slider_moved' not in st.session_state:
         st.session_state.ML_familiarity_slider_moved = False    
     
-    def slider_callback(slider_name):
-        st.session_state[slider_name] = True
-
     st.title("Final questions")
     st.write("Please reply to the following questions.")
 
-    # Attention check for the Accuracy condition 
-    st.write("1. In this experiment you were shown truthful or deceptive sentences accompanied by the prediction of an AI model. Do you remember how accurate this model was?")
-    st.session_state.attention_check_accuracy = st.radio(" ", ["I don't remember", "28%", "54%", "77%", "89%", "93%"], on_change=slider_callback, args=("attention_check_accuracy_selected",))
+    # Answering a question reruns only the questionnaire, not the whole script
+    @st.fragment
+    def questions_and_next():
+        metrics.inc("app_fragment_reruns_total", fragment="final_questions")
 
-    # AI vs Average Human
-    st.write("2. How good do you think the **average human performance** is compared to the performance of the AI-based lie detector in predicting whether a statement is true or false?")
-    st.session_state.algo_vs_avg_human = st.slider("", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("algo_vs_avg_human_slider_moved",))
-    col1, col2, col3, col4, col5, col6 = st.columns([1.5,1,1,1.5,1,1.5])
-    with col1:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Algotithm's performance is better</strong></p>", unsafe_allow_html=True)
-    with col4:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Equal</strong></p>", unsafe_allow_html=True)
-    with col6:
-        st.markdown("<p style='text-align: right; color: grey; font-size: 0.9em;'><strong>Human performance is better</strong></p>", unsafe_allow_html=True)
-    
-    # AI vs Participant
-    st.write("3. How good do you think **your performance** is compared to the performance of the AI-based lie detector in distinguishing truth from lies?")
-    st.session_state.algo_vs_yourself = st.slider(" ", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("algo_vs_yourself_slider_moved",))
-    col1, col2, col3, col4, col5, col6 = st.columns([1.5,1,1,1.5,1,1.5])
-    with col1:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Algotithm's performance is better</strong></p>", unsafe_allow_html=True)
-    with col4:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Equal</strong></p>", unsafe_allow_html=True)
-    with col6:
-        st.markdown("<p style='text-align: right; color: grey; font-size: 0.9em;'><strong>My performance is better</strong></p>", unsafe_allow_html=True)
-
-    # Familiarity with ML 
-    st.write("4. How familiar are you with AI-based algorithms?")
-    st.session_state.ML_familiarity = st.slider("  ", min_value=0, max_value=10, value = 5, step=1, on_change=slider_callback, args=("ML_familiarity_slider_moved",))
-    col1, col2, col3, col4, col5, col6 = st.columns([1.5,1,1,1.5,1,1.5])
-    with col1:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Not familiar at all</strong></p>", unsafe_allow_html=True)
-    with col4:
-        st.markdown("<p style='color: grey; font-size: 0.9em;'><strong>Neutral</strong></p>", unsafe_allow_html=True)
-    with col6:
-        st.markdown("<p style='text-align: right; color: grey; font-size: 0.9em;'><strong>Very familiar</strong></p>", unsafe_allow_html=True)
+        def slider_callback(slider_name):
+            st.session_state[slider_name] = True
 
-    if st.button("Next"):
-        # Check if all required fields are filled and sliders have been moved
-        if not st.session_state.attention_check_accuracy_selected:
-            st.warning("Please select an option for question 1 before proceeding.", icon="⚠️")
-        elif not st.session_state.algo_vs_avg_human_slider_moved:
-            st.warning("Please move the slider to reply question 2 before proceeding.", icon="⚠️")
-        elif not st.session_state.algo_vs_yourself_slider_moved:
-            st.warning("Please move the slider to reply question 3 before proceeding.", icon="⚠️")
-        elif not st.session_state.ML_familiarity_slider_moved:
-            st.warning("Please move the slider to reply question 4 before proceeding.", icon="⚠️")
-        else:
-            update_progress()
-            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-            questions_data = pd.DataFrame(
-                [
-                    {
-                        'date': current_date,
-                        'accuracy_condition': st.session_state.accuracy_condition,
-                        'prolific_id': st.session_state.prolific_id,
-                        'participant_id': st.session_state.participant_id,
-                        'consent': st.session_state.consent_data,
-                        'attention_check_accuracy': st.session_state.attention_check_accuracy,
-                        'algo_vs_avg_human': st.session_state.algo_vs_avg_human,
-                        'algo_vs_yourself': st.session_state.algo_vs_yourself,
-                        'ML_familiarity': st.session_state.ML_familiarity
-                    }
-                ]
-            )
+        # Attention check for the Accuracy condition 
+        st.write("1. In this experiment you were shown truthful or deceptive sentences accompanied by the prediction of an AI model. Do you remember how accurate this model was?")
+        st.session_state.attention_check_accuracy = st.radio(" ", list(study.attention_options), on_change=slider_callback, args=("attention_check_accuracy_selected",))
+
+        # AI vs Average Human
+        st.write("2. How good do you think the **average human performance** is compared to the performance of the AI-based lie detector in predicting whether a statement is true or false?")
+        st.session_state.algo_vs_avg_human = st.slider("", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("algo_vs_avg_human_slider_moved",))
+        st.markdown(label_html.AI_VS_AVERAGE_HUMAN_HTML, unsafe_allow_html=True)
+    
+        # AI vs Participant
+        st.write("3. How good do you think **your performance** is compared to the performance of the AI-based lie detector in distinguishing truth from lies?")
+        st.session_state.algo_vs_yourself = st.slider(" ", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("algo_vs_yourself_slider_moved",))
+        st.markdown(label_html.AI_VS_YOURSELF_HTML, unsafe_allow_html=True)
+
+        # Familiarity with ML 
+        st.write("4. How familiar are you with AI-based algorithms?")
+        st.session_state.ML_familiarity = st.slider("  ", min_value=0, max_value=10, value = 5, step=1, on_change=slider_callback, args=("ML_familiarity_slider_moved",))
+        st.markdown(label_html.ML_FAMILIARITY_HTML, unsafe_allow_html=True)
+
+        if st.button("Next"):
+            # Check if all required fields are filled and sliders have been moved
+            if not st.session_state.attention_check_accuracy_selected:
+                st.warning("Please select an option for question 1 before proceeding.", icon="⚠️")
+            elif not st.session_state.algo_vs_avg_human_slider_moved:
+                st.warning("Please move the slider to reply question 2 before proceeding.", icon="⚠️")
+            elif not st.session_state.algo_vs_yourself_slider_moved:
+                st.warning("Please move the slider to reply question 3 before proceeding.", icon="⚠️")
+            elif not st.session_state.ML_familiarity_slider_moved:
+                st.warning("Please move the slider to reply question 4 before proceeding.", icon="⚠️")
+            else:
+                update_progress()
+                current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+                questions_data = {
+                    'date': current_date,
+                    'study': study.name,
+                    'accuracy_condition': st.session_state.accuracy_condition,
+                    'prolific_id': st.session_state.prolific_id,
+                    'participant_id': st.session_state.participant_id,
+                    'consent': st.session_state.consent_data,
+                    'consent_time': st.session_state.get('consent_time'),
+                    'attention_check_accuracy': st.session_state.attention_check_accuracy,
+                    'algo_vs_avg_human': st.session_state.algo_vs_avg_human,
+                    'algo_vs_yourself': st.session_state.algo_vs_yourself,
+                    'ML_familiarity': st.session_state.ML_familiarity
+                }
         
-            # Store response_data in session state
-            st.session_state.questions_data = questions_data
-            st.session_state.page = 'feedback'
-            st.rerun()
+                # Store response_data in session state
+                st.session_state.questions_data = questions_data
+                st.session_state.page = 'feedback'
+                st.rerun(scope="app")
+
+    questions_and_next()
 
 def feedback_page():
+    import storage
+    from sqlalchemy.exc import SQLAlchemyError
+
     scroll_to_top()
     show_progress_bar()
 
@@ -568,52 +714,60 @@ def feedback_page():
     if 'difficulty_check' not in st.session_state:
         st.session_state.difficulty_check = False    
 
-    def slider_callback(slider_name):
-        st.session_state[slider_name] = True
-            
     st.title("Feedback")
     st.write("Please provide us with feedback about the study. Your feedback is valuable to us and will help us improve our study.")
-    
-    st.write("**1. How much were you motivated to perform well?**")
-    st.session_state.motivation_scale = st.slider("0 = Not at all, 10 = Very much", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("motivation_check",))
 
-    st.write("**2. How difficult did you find the study?**")
-    st.session_state.difficulty_scale = st.slider("0 = Very easy, 10 = Very difficult", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("difficulty_check",))
-    
-    st.write("**3. You can leave here any comment about this experiment (Optional).**")
-    st.session_state.feedback = st.text_area("Feedback")
+    # Answering a question reruns only the questionnaire, not the whole script
+    @st.fragment
+    def questions_and_submit():
+        metrics.inc("app_fragment_reruns_total", fragment="feedback")
 
-    st.write("Please click on the button below to submit your feedback.")
-    
-    if st.button("Submit Feedback"): 
-        if not st.session_state.motivation_check:
-            st.warning("Please move the slider to reply question 1 before proceeding.", icon="⚠️")
-        elif not st.session_state.difficulty_check:
-            st.warning("Please move the slider to reply question 2 before proceeding.", icon="⚠️")
-        else:
-                update_progress()
-                feedback_data = pd.DataFrame(
-                  [
-                    {
+        def slider_callback(slider_name):
+            st.session_state[slider_name] = True
+
+        st.write("**1. How much were you motivated to perform well?**")
+        st.session_state.motivation_scale = st.slider("0 = Not at all, 10 = Very much", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("motivation_check",))
+
+        st.write("**2. How difficult did you find the study?**")
+        st.session_state.difficulty_scale = st.slider("0 = Very easy, 10 = Very difficult", min_value=0, max_value=10, value=5, step=1, on_change=slider_callback, args=("difficulty_check",))
+
+        st.write("**3. You can leave here any comment about this experiment (Optional).**")
+        st.session_state.feedback = st.text_area("Feedback")
+
+        st.write("Please click on the button below to submit your feedback.")
+
+        if st.button("Submit Feedback"): 
+            if not st.session_state.motivation_check:
+                st.warning("Please move the slider to reply question 1 before proceeding.", icon="⚠️")
+            elif not st.session_state.difficulty_check:
+                st.warning("Please move the slider to reply question 2 before proceeding.", icon="⚠️")
+            else:
+                    questionnaire_row = {
+                        **st.session_state.questions_data,
                         "motivation": st.session_state.motivation_scale,
                         "difficulty": st.session_state.difficulty_scale,
-                        "feedback": st.session_state.feedback
-                     }
-                   ]
-                 )
-        
-                        
-                # Retrieve response_data and questions_data from session state
-                questions_data = st.session_state.questions_data
-        
-                # Concatenate all data into a single list
-                combined_data = pd.concat([questions_data,feedback_data], axis=1)
-                updated_df = pd.concat([participant_data, combined_data], ignore_index=True)
-                conn.update(worksheet="Sheet2", data=updated_df)
-        
-                st.write("Thank you for your feedback.")
-                st.session_state.page = 'end'
-                st.rerun()
+                        "feedback": st.session_state.feedback,
+                    }
+                    trial_rows = []
+                    if persistence_mode == "end_of_session":
+                        corpus = load_study(study.name).corpus
+                        trial_rows = [trial_row(corpus, index) for index in range(len(st.session_state.trial_plan))]
+
+                    # One transaction with the questionnaire (and, at the end of the session, all trials)
+                    try:
+                        with metrics.timed("app_phase_seconds", phase="db_session_commit"):
+                            storage.write_session(db_engine(), trial_rows, questionnaire_row)
+                    except SQLAlchemyError as e:
+                        logging.getLogger(__name__).error("Could not store the session of %s: %s", st.session_state.participant_id, e)
+                        st.error("Your answers could not be saved. Please click on Submit Feedback again.", icon="🚨")
+                        return
+
+                    update_progress()
+                    st.write("Thank you for your feedback.")
+                    st.session_state.page = 'end'
+                    st.rerun(scope="app")
+
+    questions_and_submit()
                  
 def end_page():
     update_progress()
@@ -635,23 +789,52 @@ def end_page():
         st.markdown(f'<meta http-equiv="refresh" content="0;url={prolific_home_url}">', unsafe_allow_html=True)
 
 
-# Page Navigation Logic
-if 'page' not in st.session_state:
-    st.session_state.page = 'welcome'
+pages = {
+    'welcome': welcome_page,
+    'consent': consent_page,
+    'instructions': instructions_page,
+    'example': example_page,
+    'experiment': experiment_page,
+    'final_questions': final_questions,
+    'feedback': feedback_page,
+    'end': end_page,
+}
+
+# A fraction of sessions get every page run profiled with cProfile
+if 'profiled' not in st.session_state:
+    st.session_state.profiled = random.random() < metrics_settings.get("profile_fraction", 0)
+
+def run_page(name, page_function):
+    metrics.inc("app_reruns_total", page=name)
+    with metrics.timed("app_page_seconds", page=name):
+        if st.session_state.profiled:
+            with metrics.profiled(metrics_settings.get("profile_dir", "profiles"), f"{st.session_state.participant_id}-{name}"):
+                page_function()
+        else:
+            page_function()
+
+def waiting_page():
+    st.title("Welcome to the _'UNMASK THE LIES'_ study")
+    st.write("Many people are taking part right now. You will be let in automatically as soon as a place is free, please keep this page open.")
 
-if st.session_state.page == 'welcome':
-    welcome_page()
-elif st.session_state.page == 'consent':
-    consent_page()
-elif st.session_state.page == 'instructions':
-    instructions_page()
-elif st.session_state.page == 'example':
-    example_page()
-elif st.session_state.page == 'experiment':
-    experiment_page()
-elif st.session_state.page == 'final_questions':
-    final_questions()
-elif st.session_state.page == 'feedback':
-    feedback_page()
-elif st.session_state.page == 'end':
-    end_page()
+    # Only this block reruns while waiting, until the participant is admitted
+    @st.fragment(run_every=admission_controller.poll_interval)
+    def queue_position():
+        admitted, position = admission_controller.admit(session_key)
+        if admitted:
+            st.rerun()
+        st.info(f"Your place in the queue: **{position}**", icon="⏳")
+
+    queue_position()
+
+if admin_request:
+    import admin
+    prepare_responses_table()
+    admin.admin_page(get_connection())
+elif st.session_state.page in pages:
+    if not admitted:
+        run_page('waiting', waiting_page)
+    elif intro_client_side and st.session_state.page in INTRO_PAGES:
+        run_page('intro', intro_page)
+    else:
+        run_page(st.session_state.page, pages[st.session_state.page])
@@ -0,0 +1,262 @@
+# Load test: drives simulated participants through the whole study with
+# Streamlit's AppTest, against a throwaway SQLite database standing in for MySQL.
+#
+#     python benchmarks/load_test.py --participants 40 --workers 4 --concurrency 5
+#
+# Each worker process runs `concurrency` participants at a time in threads, so the
+# participants of a worker share its caches, connection pool and write queue like
+# the sessions of one Streamlit server do. Reported:
+#   - rerun latency percentiles per page
+#   - database write statements per completed session
+#   - peak RSS per concurrent session (worker peak minus its idle baseline)
+#   - completed sessions per minute
+
+import argparse
+import json
+import os
+import re
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "app-2.py")
+sys.path.insert(0, REPO_DIR)
+
+import storage  # noqa: E402
+
+WRITE_STATEMENT = re.compile(r"\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", re.IGNORECASE)
+
+INTRO_BUTTONS = ["Next", "Accept", "Next", "Next", "Next", "Let's go"]
+
+
+def prepare_environment(workdir, persistence):
+    # The app creates its tables and the Sheet1 view on first start
+    db_path = os.path.join(workdir, "responses.db")
+    secrets_path = os.path.join(workdir, "secrets.toml")
+    with open(secrets_path, "w", encoding="utf-8") as f:
+        f.write(f'[connections.sql]\nurl = "sqlite:///{db_path}"\n\n')
+        f.write(f'[write_queue]\njournal_path = "{os.path.join(workdir, "journal.jsonl")}"\n\n')
+        f.write(f'[session_store]\nbackend = "sqlite"\npath = "{os.path.join(workdir, "sessions.db")}"\n\n')
+        f.write(f'[persistence]\nmode = "{persistence}"\n')
+    return db_path, secrets_path
+
+
+class Participant:
+    def __init__(self, timings):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(APP_PATH, default_timeout=120)
+        self.timings = timings
+        self.page = "welcome"
+
+    def _page(self):
+        state = self.app.session_state
+        page = state["page"] if "page" in state else "welcome"
+        if page == "example":
+            page = f"example_{state['example_sub_page']}"
+        return page
+
+    def run(self):
+        # Time every rerun under the page it started from
+        start = time.perf_counter()
+        self.app.run()
+        self.timings[self.page].append(time.perf_counter() - start)
+        if self.app.exception:
+            raise RuntimeError(f"{self.page}: {self.app.exception[0].value}")
+        self.page = self._page()
+
+    def click(self, label):
+        button = next(button for button in self.app.button if button.label == label)
+        button.click()
+        self.run()
+
+    def complete_study(self):
+        self.run()
+        for label in INTRO_BUTTONS:
+            self.click(label)
+        while self.page == "experiment":
+            slider = next(slider for slider in self.app.slider if slider.label == "Your Judgment:")
+            slider.set_value(7)
+            self.click("Submit")
+        self.app.radio[0].set_value("54%")
+        for slider in self.app.slider:
+            slider.set_value(6)
+        self.click("Next")
+        for slider in self.app.slider:
+            slider.set_value(4)
+        self.click("Submit Feedback")
+        return self.page == "end"
+
+
+def count_writes():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    counter = defaultdict(int)
+    lock = threading.Lock()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        match = WRITE_STATEMENT.match(statement)
+        if match:
+            with lock:
+                counter[match.group(1)] += 1
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    return counter
+
+
+def serialize_script_compilation():
+    # Every AppTest compiles the script itself, and concurrent ast.parse calls
+    # can fail on CPython 3.11 ("AST constructor recursion depth mismatch")
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    get_bytecode = ScriptCache.get_bytecode
+    lock = threading.Lock()
+
+    def locked_get_bytecode(self, script_path):
+        with lock:
+            return get_bytecode(self, script_path)
+
+    ScriptCache.get_bytecode = locked_get_bytecode
+
+
+def share_test_runtime():
+    # AppTest installs a mock Runtime for the length of each run and removes it afterwards,
+    # so participants running at the same time may find no runtime, or one whose component
+    # registry never saw the st.components.v2 components. All runs share one registry here,
+    # and the runtime of the latest run stays visible in between
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import AppTest
+
+    registry = BidiComponentManager()
+    registry.discover_and_register_components(start_file_watching=False)
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+        if not latest:
+            raise RuntimeError("Runtime hasn't been created!")
+        return latest[0]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(latest))
+
+    init = AppTest.__init__
+
+    def shared_registry_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self._bidi_component_manager = registry
+
+    AppTest.__init__ = shared_registry_init
+
+
+def run_worker(secrets_path, participants, concurrency):
+    from streamlit import config
+
+    config.set_option("secrets.files", [secrets_path])
+    serialize_script_compilation()
+    share_test_runtime()
+    os.chdir(REPO_DIR)
+    writes = count_writes()
+    timings = defaultdict(list)
+
+    # Warm the process caches once, then take the idle baseline
+    Participant(defaultdict(list)).run()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    writes.clear()
+
+    def one_participant(_):
+        try:
+            return Participant(timings).complete_study(), None
+        except Exception:
+            return False, traceback.format_exc()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_participant, range(participants)))
+
+    time.sleep(1)  # let the write queue flush
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "completed": sum(1 for ok, _ in results if ok),
+        "errors": [error for _, error in results if error],
+        "timings": dict(timings),
+        "writes": dict(writes),
+        "rss_per_session_kb": max(0, peak_rss - baseline_rss) / concurrency,
+    }
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent participants end-to-end.")
+    parser.add_argument("--participants", type=int, default=20, help="total simulated participants")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes")
+    parser.add_argument("--concurrency", type=int, default=5, help="concurrent participants per worker")
+    parser.add_argument("--persistence", choices=["per_trial", "end_of_session"], default="per_trial",
+                        help="when trial rows are written")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path, secrets_path = prepare_environment(workdir, args.persistence)
+        shares = [args.participants // args.workers + (i < args.participants % args.workers) for i in range(args.workers)]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            reports = list(pool.map(run_worker, [secrets_path] * args.workers, shares, [args.concurrency] * args.workers))
+        elapsed = time.perf_counter() - start
+        with sqlite3.connect(db_path) as db:
+            stored_rows = db.execute(f"SELECT COUNT(*) FROM {storage.RESPONSES_TABLE}").fetchone()[0]
+
+    timings = defaultdict(list)
+    for report in reports:
+        for page, values in report["timings"].items():
+            timings[page].extend(values)
+    completed = sum(report["completed"] for report in reports)
+    errors = [error for report in reports for error in report["errors"]]
+    summary = {
+        "participants": args.participants,
+        "completed": completed,
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 2),
+        "sessions_per_minute": round(completed / elapsed * 60, 1),
+        "writes_per_participant": {
+            table: round(sum(r["writes"].get(table, 0) for r in reports) / args.participants, 1)
+            for table in sorted({table for r in reports for table in r["writes"]})
+        },
+        "stored_rows": stored_rows,
+        "peak_rss_per_session_kb": round(max(r["rss_per_session_kb"] for r in reports)),
+        "rerun_ms": {
+            page: {q: round(percentile(values, q) * 1000, 1) for q in (50, 90, 99)} | {"n": len(values)}
+            for page, values in sorted(timings.items())
+        },
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            if key != "rerun_ms":
+                print(f"{key:>24}: {value}")
+        print(f"\n{'page':<16}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+        for page, stats in summary["rerun_ms"].items():
+            print(f"{page:<16}{stats['n']:>6}{stats[50]:>10}{stats[90]:>10}{stats[99]:>10}")
+    if errors:
+        print(f"\nFirst error:\n{errors[0]}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
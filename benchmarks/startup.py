@@ -0,0 +1,97 @@
+# Cold-start check: what the first page of a fresh server process imports.
+#
+#     python benchmarks/startup.py --budget-ms 300
+#
+# Runs the welcome page once in a new interpreter under `python -X importtime`,
+# with Streamlit and AppTest already imported, and reports:
+#   - wall time of that first run
+#   - the import time it added, with the slowest top-level imports
+#   - whether any of the data-stack modules were loaded, which the intro pages
+#     should not need
+# Exits with status 1 when the import time is over budget or a data-stack
+# module was imported.
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "app-2.py")
+
+MARKER = "--- first app run ---"
+DATA_STACK = ["numpy", "pandas", "pyarrow", "sqlalchemy"]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def child(secrets_path):
+    from streamlit import config
+    from streamlit.testing.v1 import AppTest
+
+    config.set_option("secrets.files", [secrets_path])
+    os.chdir(REPO_DIR)
+    app = AppTest.from_file(APP_PATH, default_timeout=60)
+    before = set(sys.modules)
+    print(MARKER, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    app.run()
+    elapsed = time.perf_counter() - start
+    loaded = sorted({name.split(".")[0] for name in set(sys.modules) - before})
+    print(json.dumps({"first_run_s": elapsed, "loaded": loaded, "exception": [str(e.value) for e in app.exception]}))
+
+
+def parse_import_times(stderr):
+    # Top-level imports (no indentation) made after the marker: name -> cumulative microseconds
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    totals = {}
+    for line in lines:
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            totals[match.group(4)] = totals.get(match.group(4), 0) + int(match.group(2))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the imports of a cold start.")
+    parser.add_argument("--budget-ms", type=float, default=300, help="allowed import time of the first run")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Default settings: no session store, so nothing needs the database before the first trial
+        secrets_path = os.path.join(workdir, "secrets.toml")
+        with open(secrets_path, "w", encoding="utf-8") as f:
+            f.write(f'[connections.sql]\nurl = "sqlite:///{os.path.join(workdir, "responses.db")}"\n')
+        result = subprocess.run([sys.executable, "-X", "importtime", __file__, "--child", secrets_path],
+                                capture_output=True, text=True, cwd=REPO_DIR)
+    if result.returncode:
+        sys.exit(result.stderr[-2000:])
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    import_times = parse_import_times(result.stderr)
+    total_ms = sum(import_times.values()) / 1000
+    data_stack = [name for name in DATA_STACK if name in report["loaded"]]
+
+    print(f"{'first run':>16}: {report['first_run_s'] * 1000:.0f} ms")
+    print(f"{'imports':>16}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"{'data stack':>16}: {', '.join(data_stack) or 'not loaded'}")
+    print(f"\n{'module':<40}{'cumulative ms':>14}")
+    for name, micros in sorted(import_times.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<40}{micros / 1000:>14.1f}")
+    if report["exception"]:
+        print(f"\nThe app raised: {report['exception']}", file=sys.stderr)
+
+    if report["exception"] or data_stack or total_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Optional reading times measured in the participant's browser.
+#
+# A script-only st.components.v2 component, which runs in the app page itself
+# rather than an iframe, notes performance.now() when a trial is first shown
+# (kept in sessionStorage, so reruns of the same trial keep the first value). A
+# capture-phase click listener on the document, installed once per page load,
+# writes the elapsed time into the URL (?rt=<trial key>:<microseconds>)
+# just before the Submit click is handled. Streamlit sends the current query
+# string with every rerun, so the value reaches the server with the Submit
+# rerun itself, without an extra round trip.
+
+QUERY_PARAM = "rt"
+
+# Mounted with data = {"trial_key": ...}
+TIMER_JS = """
+export default function ({ data }) {
+    const key = data.trial_key;
+    if (sessionStorage.getItem("reading-start-" + key) === null) {
+        sessionStorage.setItem("reading-start-" + key, String(performance.now()));
+    }
+    window.readingTimerKey = key;
+    if (window.readingTimerInstalled) return;
+    window.readingTimerInstalled = true;
+    document.addEventListener("click", (event) => {
+        const button = event.target.closest("button");
+        if (!button || button.innerText.trim() !== "Submit" || !window.readingTimerKey) return;
+        const start = sessionStorage.getItem("reading-start-" + window.readingTimerKey);
+        if (start === null) return;
+        const url = new URL(window.location.href);
+        url.searchParams.set("%s", window.readingTimerKey + ":" + Math.round((performance.now() - Number(start)) * 1000));
+        window.history.replaceState(window.history.state, "", url);
+    }, true);
+}
+""" % QUERY_PARAM
+
+
+def read_duration_us(value, trial_key):
+    # The reported reading time in microseconds, or None if missing or for another trial
+    if not value:
+        return None
+    reported_key, _, micros = value.rpartition(":")
+    if reported_key != trial_key or not micros.isdigit():
+        return None
+    return int(micros)
@@ -0,0 +1,161 @@
+# Removes duplicated rows from a legacy Sheet1 table (before migrate.py) or
+# from the Sheet1_legacy table it leaves behind.
+#
+#     python compact.py --url mysql+mysqlconnector://user:pw@host/db
+#     python compact.py --url ... --table Sheet1_legacy --drop
+#
+# Older versions of the app re-inserted every earlier trial of a participant on
+# each Submit, so early trials can be stored up to 12 times. The table is read
+# once, in keyset pages of --chunk-size participants (participant_id > last
+# ORDER BY participant_id, on an index added for the scan), which keeps memory
+# flat on every driver, mysqlconnector included. All duplicates of a trial
+# belong to one participant and so to one page: the first row of each
+# (participant_id, statement_id, statement_condition) is kept and written to
+# <table>_compact in batches of short transactions, and the keys seen are
+# dropped with the page. Rows without a participant_id are copied once with
+# SELECT DISTINCT. The compacted table then takes the name of the original in
+# one atomic rename (RENAME TABLE on MySQL, a transaction elsewhere), and the
+# original is kept as <table>_before_compaction (dropped with --drop).
+#
+# Current versions of the app never write to these tables. If rows were added
+# while the scan ran, the swap is skipped and <table>_compact is left for a
+# second look.
+
+import argparse
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+import migrate
+import storage
+
+COMPACT_SUFFIX = "_compact"
+BEFORE_SUFFIX = "_before_compaction"
+
+
+def _count(engine, table):
+    with engine.connect() as db:
+        return db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar_one()
+
+
+def default_table(engine):
+    # Sheet1 before the migration, Sheet1_legacy after it
+    names = inspect(engine).get_table_names()
+    return storage.RESPONSES_TABLE if storage.RESPONSES_TABLE in names else migrate.LEGACY_TABLE
+
+
+def _swap(engine, table, compact_table, before_table, drop):
+    with engine.begin() as db:
+        if engine.dialect.name in storage.MYSQL_DIALECTS:
+            # Each ALTER TABLE commits on its own there; one RENAME TABLE swaps both names atomically
+            db.execute(text(f"RENAME TABLE {table} TO {before_table}, {compact_table} TO {table}"))
+        else:
+            db.execute(text(f"ALTER TABLE {table} RENAME TO {before_table}"))
+            db.execute(text(f"ALTER TABLE {compact_table} RENAME TO {table}"))
+    if drop:
+        with engine.begin() as db:
+            db.execute(text(f"DROP TABLE {before_table}"))
+
+
+def compact(engine, table, key=storage.RESPONSE_KEY, chunk_size=500, batch_size=1_000, drop=False):
+    # key[0] is the column the table is paged on, participant_id
+    if not storage.is_legacy_table(engine, table):
+        return None
+    if engine.dialect.name == "sqlite":
+        # The batches are written while the scan still reads; SQLite needs WAL for that
+        with engine.connect() as db:
+            db.exec_driver_sql("PRAGMA journal_mode=WAL")
+    compact_table = table + COMPACT_SUFFIX
+    before_table = table + BEFORE_SUFFIX
+    if storage.is_legacy_table(engine, before_table):
+        raise ValueError(f"{before_table} is left from an earlier run; drop or rename it first")
+    started = time.monotonic()
+    rows_before = _count(engine, table)
+
+    with engine.begin() as db:
+        db.execute(text(f"DROP TABLE IF EXISTS {compact_table}"))
+        db.execute(text(f"CREATE TABLE {compact_table} AS SELECT * FROM {table} WHERE 1 = 0"))
+
+    columns = [column["name"] for column in inspect(engine).get_columns(table)]
+    key_positions = [columns.index(column) for column in key]
+    selected = ", ".join(columns)
+    insert = text(f"INSERT INTO {compact_table} ({selected}) "
+                  f"VALUES ({', '.join(f':{column}' for column in columns)})")
+    storage.ensure_index(engine, table, [key[0]])
+    page_end = text(f"SELECT MAX({key[0]}) FROM (SELECT {key[0]} FROM {table} WHERE {key[0]} > :last "
+                    f"GROUP BY {key[0]} ORDER BY {key[0]} LIMIT :count) page")
+    page_rows = text(f"SELECT {selected} FROM {table} WHERE {key[0]} > :last AND {key[0]} <= :upto")
+
+    scanned = kept = 0
+    batch = []
+
+    def flush():
+        with engine.begin() as db:
+            db.execute(insert, batch)
+        batch.clear()
+
+    last = ""
+    while True:
+        with engine.connect() as db:
+            upto = db.execute(page_end, {"last": last, "count": chunk_size}).scalar_one()
+            if upto is None:
+                break
+            rows = db.execute(page_rows, {"last": last, "upto": upto}).all()
+        seen = set()
+        for row in rows:
+            scanned += 1
+            trial = tuple(row[position] for position in key_positions)
+            if trial in seen:
+                continue
+            seen.add(trial)
+            batch.append(dict(zip(columns, row)))
+            kept += 1
+            if len(batch) >= batch_size:
+                flush()
+        last = upto
+    if batch:
+        flush()
+
+    with engine.begin() as db:
+        orphans = db.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {key[0]} IS NULL")).scalar_one()
+        if orphans:
+            scanned += orphans
+            kept += db.execute(text(f"INSERT INTO {compact_table} ({selected}) "
+                                    f"SELECT DISTINCT {selected} FROM {table} WHERE {key[0]} IS NULL")).rowcount
+
+    report = {"table": table, "scanned": scanned, "kept": kept, "removed": scanned - kept, "swapped": False}
+    # Rows added during the scan are not in the compacted table
+    if _count(engine, table) != scanned or rows_before != scanned:
+        report["compacted_table"] = compact_table
+    else:
+        _swap(engine, table, compact_table, before_table, drop)
+        report["swapped"] = True
+        if not drop:
+            report["original_table"] = before_table
+    report["seconds"] = round(time.monotonic() - started, 1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicated trials from a legacy Sheet1 table.")
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--table", help=f"table to compact (default: {storage.RESPONSES_TABLE} if it is still a "
+                                        f"table, else {migrate.LEGACY_TABLE})")
+    parser.add_argument("--chunk-size", type=int, default=500, help="participants read at a time")
+    parser.add_argument("--batch-size", type=int, default=1_000, help="rows written per transaction")
+    parser.add_argument("--drop", action="store_true", help="drop the original table after the swap")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    table = args.table or default_table(engine)
+    try:
+        report = compact(engine, table, chunk_size=args.chunk_size, batch_size=args.batch_size, drop=args.drop)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if report is None:
+        print(f"{table} is not a table, nothing to compact")
+    else:
+        for name, value in report.items():
+            print(f"{name:>15}: {value}")
+        if not report["swapped"]:
+            print(f"Rows were added to {table} during the scan; it was left as it is")
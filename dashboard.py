@@ -0,0 +1,97 @@
+# Running aggregates for the live dashboard of the admin view.
+#
+# Each refresh only reads the trials and questionnaires stored since the last
+# one (trial_seq / questionnaire_seq above the high-water mark) and folds them
+# into running counts, so a refresh costs the same with 100 or 10,000
+# participants. The aggregates are rebuilt from scratch every rebuild_interval
+# seconds, which also picks up a row that committed after a later one had
+# already been read. Reading times go into a fixed-bin histogram, so memory and
+# the median stay the same size however many trials there are.
+
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+import storage
+
+# The attention checks ask for one slider position; this much off still passes
+ATTENTION_TOLERANCE = 2
+
+# Reading-time histogram: 0.1 s bins, the last one collecting everything from 10 minutes on
+DURATION_BIN_SECONDS = 0.1
+DURATION_BINS = 6000
+
+
+class LiveAggregates:
+    def __init__(self, engine, batch_size=5000, rebuild_interval=3600):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.trial_seq = 0
+        self.questionnaire_seq = 0
+        self.completed = Counter()        # accuracy_condition -> completed sessions
+        self.attention = Counter()        # "passed" / "checked"
+        self.agreement = {}               # confidence_range -> [agreeing, trials]
+        self.duration_counts = np.zeros(DURATION_BINS, dtype=np.int64)
+        self.built_at = time.monotonic()
+
+    def refresh(self):
+        with self._lock:
+            if time.monotonic() - self.built_at > self.rebuild_interval:
+                self._reset()
+            while rows := storage.read_trials_since(self.engine, self.trial_seq, self.batch_size):
+                self._add_trials(rows)
+            while rows := storage.read_completions_since(self.engine, self.questionnaire_seq, self.batch_size):
+                self.completed.update(condition for _, condition in rows)
+                self.questionnaire_seq = rows[-1][0]
+
+    def _add_trials(self, rows):
+        seq, conditions, ranges, durations, ai, participant = (np.array(column) for column in zip(*rows))
+        ai = ai.astype(float)
+        participant = participant.astype(float)
+        self.trial_seq = int(seq[-1])
+
+        checks = conditions == "attention_check"
+        self.attention["checked"] += int(checks.sum())
+        self.attention["passed"] += int((np.abs(participant[checks] - ai[checks]) <= ATTENTION_TOLERANCE).sum())
+
+        # Agreement: the participant leans to the same side (truthful / deceptive) as the AI
+        agrees = np.sign(participant) == np.sign(ai)
+        for confidence_range in np.unique(ranges[~checks]):
+            in_range = (ranges == confidence_range) & ~checks
+            counts = self.agreement.setdefault(str(confidence_range), [0, 0])
+            counts[0] += int(agrees[in_range].sum())
+            counts[1] += int(in_range.sum())
+
+        durations = durations[~checks].astype(float)
+        durations = durations[np.isfinite(durations) & (durations >= 0)]
+        bins = np.minimum((durations / DURATION_BIN_SECONDS).astype(np.int64), DURATION_BINS - 1)
+        self.duration_counts += np.bincount(bins, minlength=DURATION_BINS)
+
+    def median_duration(self):
+        # Midpoint of the bin holding the middle trial
+        total = int(self.duration_counts.sum())
+        if not total:
+            return None
+        middle = int(np.searchsorted(np.cumsum(self.duration_counts), (total + 1) / 2))
+        return (middle + 0.5) * DURATION_BIN_SECONDS
+
+    def summary(self):
+        with self._lock:
+            return {
+                "completed": dict(self.completed),
+                "attention_checked": self.attention["checked"],
+                "attention_pass_rate": self.attention["passed"] / self.attention["checked"] if self.attention["checked"] else None,
+                "agreement": [
+                    {"confidence_range": confidence_range, "trials": total, "agreement": agreeing / total}
+                    for confidence_range, (agreeing, total) in sorted(self.agreement.items())
+                ],
+                "median_duration": self.median_duration(),
+                "trials": int(self.duration_counts.sum()),
+            }
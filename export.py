@@ -0,0 +1,289 @@
+# Streaming export of the collected data for analysis.
+#
+#     python export.py trials --url mysql+mysqlconnector://user:pw@host/db --out exports/
+#     python export.py questionnaire --url ... --out exports/ --format csv
+#
+# Rows are read in keyset pages (seq > last ORDER BY seq LIMIT chunk), which
+# keeps memory flat on every driver, including mysqlconnector, which has no
+# server-side cursors, and go straight to Parquet row groups (needs pyarrow) or
+# gzip CSV. Files are rolled every --rows-per-file rows and named after the
+# first and last sequence number they hold; after each file is closed,
+# <name>.last_seq in the output directory records where it stopped, and the next
+# run continues from there.
+#
+# <name> is the table for an unfiltered export. Filtered exports (--since,
+# --until, --condition, --study, --with-text) get a name of their own,
+# <table>_<digest of the filters>, with the filters in <name>.filters.json, so
+# a filtered run never moves the resume point of another one.
+#
+# A run only exports up to a settled high-water mark: the largest sequence
+# number when it starts, read again after --settle-seconds. Sequence numbers
+# are handed out when a row is inserted, not when it is committed, so a row
+# still in an open transaction may sit below rows that are already visible;
+# waiting lets those transactions commit before the resume point passes them.
+#
+# The statement texts are left out unless --with-text is given: trials
+# reference them by text_sha1, and `python export.py statements` exports them once.
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from sqlalchemy import create_engine, text
+
+import storage
+
+# Per table: sequence column (for resuming), columns with their Parquet types, FROM clause
+EXPORTS = {
+    "trials": (
+        "t.trial_seq",
+        [
+            ("trial_seq", "int64"),
+            ("study", "string"),
+            ("date", "string"),
+            ("accuracy_condition", "string"),
+            ("prolific_id", "string"),
+            ("participant_id", "string"),
+            ("consent", "string"),
+            ("consent_time", "string"),
+            ("statement_id", "string"),
+            ("statement_condition", "string"),
+            ("text_sha1", "string"),
+            ("confidence_range", "string"),
+            ("duration", "float64"),
+            ("duration_ns", "int64"),
+            ("client_duration_us", "int64"),
+            ("correct_prediction", "bool"),
+            ("ai_judgment", "int16"),
+            ("participant_judgment", "int16"),
+        ],
+        f"""{storage.TRIALS_TABLE} t
+            JOIN {storage.PARTICIPANTS_TABLE} p ON p.participant_id = t.participant_id""",
+    ),
+    "questionnaire": (
+        "q.questionnaire_seq",
+        [
+            ("questionnaire_seq", "int64"),
+            ("study", "string"),
+            ("date", "string"),
+            ("accuracy_condition", "string"),
+            ("prolific_id", "string"),
+            ("participant_id", "string"),
+            ("consent", "string"),
+            ("consent_time", "string"),
+            ("attention_check_accuracy", "string"),
+            ("algo_vs_avg_human", "int16"),
+            ("algo_vs_yourself", "int16"),
+            ("ML_familiarity", "int16"),
+            ("motivation", "int16"),
+            ("difficulty", "int16"),
+            ("feedback", "string"),
+        ],
+        f"""{storage.QUESTIONNAIRE_TABLE} q
+            JOIN {storage.PARTICIPANTS_TABLE} p ON p.participant_id = q.participant_id""",
+    ),
+}
+
+# Which alias each column is read from; everything else is on the table being exported
+PARTICIPANT_ALIASED = {"study": "p", "date": "p", "accuracy_condition": "p", "prolific_id": "p", "consent": "p",
+                      "consent_time": "p", "participant_id": "p"}
+
+
+def _export_query(table, with_text, since, until, condition, study=None):
+    seq_column, columns, source = EXPORTS[table]
+    alias = seq_column.split(".")[0]
+    selected = [f"{PARTICIPANT_ALIASED.get(name, alias)}.{name}" for name, _ in columns]
+    if with_text and table == "trials":
+        selected.append("s.text")
+        columns = columns + [("text", "string")]
+        source += f"\n LEFT JOIN {storage.STATEMENTS_TABLE} s ON s.text_sha1 = t.text_sha1"
+
+    where = [f"{seq_column} > :after_seq", f"{seq_column} <= :high_water"]
+    if since:
+        where.append("p.date >= :since")
+    if until:
+        where.append("p.date <= :until")
+    if condition:
+        where.append("p.accuracy_condition = :condition")
+    if study:
+        where.append("p.study = :study")
+    query = f"SELECT {', '.join(selected)} FROM {source} WHERE {' AND '.join(where)} ORDER BY {seq_column} LIMIT :chunk_size"
+    return query, columns
+
+
+class _ParquetFile:
+    def __init__(self, path, columns):
+        # Only the export needs pyarrow
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in columns])
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        # One row group per chunk
+        arrays = [self._pa.array(values, from_pandas=True).cast(field.type) if values else self._pa.array([], field.type)
+                  for values, field in zip(zip(*rows), self.schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class _CsvFile:
+    def __init__(self, path, columns):
+        self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(name for name, _ in columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+FORMATS = {"parquet": (_ParquetFile, ".parquet"), "csv": (_CsvFile, ".csv.gz")}
+
+
+def export_name(table, filters):
+    # filters: name -> value; unset filters are left out
+    filters = {name: value for name, value in filters.items() if value}
+    if not filters:
+        return table
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    return f"{table}_{digest}"
+
+
+def _state_path(out_dir, name):
+    return os.path.join(out_dir, f"{name}.last_seq")
+
+
+def read_last_seq(out_dir, name):
+    try:
+        with open(_state_path(out_dir, name), encoding="utf-8") as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return 0
+
+
+def _save_last_seq(out_dir, name, last_seq):
+    path = _state_path(out_dir, name)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(str(last_seq))
+    os.replace(path + ".tmp", path)
+
+
+def export_statements(engine, out_dir, fmt="parquet"):
+    # A few hundred rows; written whole each time
+    file_class, suffix = FORMATS[fmt]
+    columns = [(name, "string") for name in storage.STATEMENT_COLUMNS]
+    path = os.path.join(out_dir, f"statements{suffix}")
+    with engine.connect() as db:
+        rows = db.execute(text(f"SELECT {', '.join(storage.STATEMENT_COLUMNS)} FROM {storage.STATEMENTS_TABLE} "
+                               f"ORDER BY statement_id, statement_condition")).all()
+    output = file_class(path, columns)
+    output.write(rows)
+    output.close()
+    return {"files": [path], "rows": len(rows)}
+
+
+def _high_water(engine, table):
+    seq_column = EXPORTS[table][0].split(".")[1]
+    source = storage.TRIALS_TABLE if table == "trials" else storage.QUESTIONNAIRE_TABLE
+    with engine.connect() as db:
+        return db.execute(text(f"SELECT COALESCE(MAX({seq_column}), 0) FROM {source}")).scalar_one()
+
+
+def export(engine, table, out_dir, fmt="parquet", chunk_size=10_000, rows_per_file=1_000_000,
+           since=None, until=None, condition=None, with_text=False, after_seq=None, study=None, settle_seconds=5):
+    os.makedirs(out_dir, exist_ok=True)
+    if table == "statements":
+        return export_statements(engine, out_dir, fmt)
+    file_class, suffix = FORMATS[fmt]
+    filters = {"since": since, "until": until, "condition": condition, "study": study, "with_text": with_text}
+    name = export_name(table, filters)
+    if name != table:
+        with open(os.path.join(out_dir, f"{name}.filters.json"), "w", encoding="utf-8") as f:
+            json.dump(filters, f, sort_keys=True)
+    if after_seq is None:
+        after_seq = read_last_seq(out_dir, name)
+    query, columns = _export_query(table, with_text, since, until, condition, study)
+
+    # Rows up to the largest sequence number seen before the wait are settled afterwards
+    high_water = _high_water(engine, table)
+    if settle_seconds:
+        time.sleep(settle_seconds)
+    params = {"high_water": high_water, "chunk_size": chunk_size, "since": since, "until": until,
+              "condition": condition, "study": study}
+
+    files = []
+    exported = 0
+    output = None
+    temp_path = os.path.join(out_dir, f".{name}-partial{suffix}")
+
+    def finish_file(first_seq, last_seq):
+        output.close()
+        path = os.path.join(out_dir, f"{name}-{first_seq:012d}-{last_seq:012d}{suffix}")
+        os.replace(temp_path, path)
+        files.append(path)
+        _save_last_seq(out_dir, name, last_seq)
+
+    last_seq = after_seq
+    file_rows = 0
+    while True:
+        with engine.connect() as db:
+            rows = db.execute(text(query), {**params, "after_seq": last_seq}).all()
+        if not rows:
+            break
+        if output is None:
+            output = file_class(temp_path, columns)
+            first_seq, file_rows = rows[0][0], 0
+        output.write(rows)
+        file_rows += len(rows)
+        exported += len(rows)
+        last_seq = rows[-1][0]
+        if file_rows >= rows_per_file:
+            finish_file(first_seq, last_seq)
+            output = None
+        if len(rows) < chunk_size:
+            break
+    if output is not None:
+        finish_file(first_seq, last_seq)
+    # Rows up to the high-water mark that the filters left out need no second look
+    if high_water > read_last_seq(out_dir, name) and high_water > after_seq:
+        _save_last_seq(out_dir, name, high_water)
+
+    return {"files": files, "rows": exported, "after_seq": after_seq,
+            "last_seq": read_last_seq(out_dir, name)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the collected data to Parquet or gzip CSV files in pages.")
+    parser.add_argument("table", choices=[*EXPORTS, "statements"])
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--out", default="exports", help="output directory")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="rows fetched and written at a time")
+    parser.add_argument("--rows-per-file", type=int, default=1_000_000)
+    parser.add_argument("--since", help="first participant date to include (YYYY-MM-DD)")
+    parser.add_argument("--until", help="last participant date to include (YYYY-MM-DD)")
+    parser.add_argument("--condition", help="only this accuracy_condition")
+    parser.add_argument("--study", help="only participants of this study (see studies.py)")
+    parser.add_argument("--with-text", action="store_true", help="include the statement text in trials")
+    parser.add_argument("--after-seq", type=int, help="start after this sequence number instead of resuming")
+    parser.add_argument("--settle-seconds", type=float, default=5,
+                        help="wait before reading, so transactions open at the start can commit")
+    args = parser.parse_args()
+
+    report = export(create_engine(args.url), args.table, args.out, args.format, args.chunk_size, args.rows_per_file,
+                    args.since, args.until, args.condition, args.with_text, args.after_seq,
+                    study=args.study, settle_seconds=args.settle_seconds)
+    for path in report["files"]:
+        print(path)
+    print(f"{report['rows']} rows exported" + (f", up to sequence {report['last_seq']}" if "last_seq" in report else ""))
@@ -0,0 +1,227 @@
+# The static intro pages (welcome, consent, instructions and the three example
+# sub-pages) as one client-side bundle.
+#
+# The markup of every page is built once per process and mounted as a single
+# st.components.v2 component. Next / Previous / Accept / Deny only switch the
+# visible page in the browser; the server hears from the bundle once, when the
+# participant leaves the intro, through the "done" trigger:
+#
+#     {"consent": "Accepted" | "Denied", "consented_at": <ISO time of the click>,
+#      "steps": <progress steps taken>, "intro_ms": <time spent in the intro>}
+#
+# The markup is the same for every study; the number of trials comes in with
+# the component data (trial_count) and is filled in by the script.
+#
+# The pages mirror the server-rendered ones in app-2.py, which are still used
+# when the bundle is disabled; the consent wording below is shared with them.
+# Consent is only reported once the participant clicked Accept or Deny (or
+# had already given it before a reconnect); "Let's go" without it leads back
+# to the consent page.
+
+import label_html
+
+# Page names of the bundle, in order; the example sub-pages are example_1..3
+SCREENS = ["welcome", "consent", "instructions", "example_1", "example_2", "example_3"]
+CONSENT_VALUES = ("Accepted", "Denied")
+
+# Consent wording, also rendered by consent_page() in app-2.py
+CONSENT_RESEARCHERS = [
+    "This study is conducted by researchers at Tilburg University (The Netherlands)",
+    "Name and email address of the principal investigator: Dr Bennett Kleinberg, bennett.kleinberg@tilburguniversity.edu",
+]
+CONSENT_APPROVAL = """The study was reviewed and approved by the university’s ethics committee.
+    Please proceed if you agree to the following:"""
+CONSENT_ITEMS = [
+    "I confirm that I have read and understood the information provided for this study.",
+    "I understand that my participation is voluntary.",
+    "I understand that I remain fully anonymous, and that I will not be identifiable in any publications or reports on the results of this study.",
+    "I understand that the data collected in this survey might be made publicly available. I know that no personal information whatsoever will be included in this dataset and that my anonymous research data can be stored for the period of 10 years.",
+    "I understand that the results of this survey will be reported in academic publications or conference presentations.",
+    "I understand that I will not benefit financially from this study or from any possible outcome it may result in in the future.",
+    "I understand that I will be compensated for participation in this study as detailed in the task description on Prolific.",
+    "I am aware of who I should contact if I wish to lodge a complaint or ask a question.",
+]
+CONSENT_PROMPT = """Please click on "Accept" if you want to give your consent and proceed with the experiment.
+    Otherwise, click on "Deny" and the experiment ends."""
+
+PLACEHOLDER_STATEMENT = """Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.
+    Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat.
+    Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur.
+    Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum."""
+
+
+def _button(button):
+    # button: (label, action), where action is a page name, "accept", "deny" or "done"
+    if button is None:
+        return "<span></span>"
+    label, action = button
+    return f"<button data-action='{action}'>{label}</button>"
+
+
+def _screen(name, title, body, left=None, right=None):
+    buttons = _button(left) + _button(right)
+    return f"""
+        <section data-screen='{name}' hidden>
+            <h1>{title}</h1>
+            {body}
+            <nav>{buttons}</nav>
+        </section>"""
+
+
+def _range(label, value, step, disabled=False):
+    attributes = " disabled" if disabled else ""
+    return f"""
+        <label class='range'>{label}
+            <output>{value}</output>
+            <input type='range' min='-50' max='50' step='{step}' value='{value}'{attributes}>
+        </label>
+        {label_html.CONFIDENCE_LABELS_HTML}
+        {label_html.TRUTHFUL_DECEPTIVE_HTML}"""
+
+
+WELCOME = _screen("welcome", "Welcome to the <em>'UNMASK THE LIES'</em> study", """
+    <p>In this study, we are investigating how people make decisions when evaluating the veracity of statements.
+       We will now give you detailed instructions. <strong>Please read them carefully.</strong></p>
+    <p>Once you complete the experiment, you will be redirected to Prolific.</p>""",
+    right=("Next", "consent"))
+
+CONSENT = _screen("consent", "Informed Consent", "".join(f"<p>{line}</p>" for line in CONSENT_RESEARCHERS) + f"""
+    <p>{CONSENT_APPROVAL}</p>
+    <ul>{"".join(f"<li>{item}</li>" for item in CONSENT_ITEMS)}</ul>
+    <p>{CONSENT_PROMPT}</p>""",
+    left=("Accept", "accept"), right=("Deny", "deny"))
+
+INSTRUCTIONS = _screen("instructions", "Instructions", """
+    <p>📖 In this experiment, you will read <strong data-trial-count>twelve</strong> short statements about past experiences that are either truthful or lies.</p>
+    <p>Your task is to guess whether each statement is truthful ✅ or a lie 🤥</p>
+    <p>These statements were randomly selected from a larger dataset where half of all statements are truthful, and half of them are lies.</p>
+    <p>To help you with your task, we provide you with the predictions of a lie detection algorithm based on artificial intelligence (AI) 🤖.</p>
+    <p>You'll see an example on the next pages.</p>
+    <p><strong>Please note that you should read the statements carefully, as after the task you will also have to take a quick quiz.
+       The quiz serves to validate your participation.</strong></p>""",
+    right=("Next", "example_1"))
+
+EXAMPLE_1 = _screen("example_1", "Example Page", f"""
+    <p>A statement will be displayed on your screen. You need to read the statement carefully.
+       For this example trial, the statement is just a placeholder.</p>
+    <p><strong>Statement:</strong> {PLACEHOLDER_STATEMENT}</p>""",
+    right=("Next", "example_2"))
+
+EXAMPLE_2 = _screen("example_2", "Example Page", f"""
+    <p>🤖 <strong>You will be provided with an algorithmic prediction for that statement.</strong> ⬇️</p>
+    {_range("AI Judgment:", 35, 10, disabled=True)}
+    <p><strong>Explanations:</strong> This slider shows you that the more the judgment is close to <strong>+50</strong>, the more the AI lie-detector is <strong>confident</strong> that the statement is <strong>truthful</strong>.
+       The more the judgment is close to <strong>-50</strong>, the more the AI lie-detector is <strong>confident</strong> that the statement is <strong>deceptive</strong>.
+       When the slider is close to zero it means that the AI lie-detector doesn't really know whether the statement is truthful or deceptive.</p>""",
+    left=("Previous", "example_1"), right=("Next", "example_3"))
+
+EXAMPLE_3 = _screen("example_3", "Example Page", f"""
+    <p><strong>Now that you've read the statement and visualized the AI judgment, it's YOUR turn!</strong></p>
+    <p>Let's have a go and try moving the slider to make YOUR judgment.
+       This is an example, so your choices have no consequences on this page.</p>
+    {_range("Your judgment", 0, 1)}
+    <p><strong>Explanations:</strong> As before, the more your judgment is close to <strong>+50</strong>, the more you are <strong>confident</strong> that the statement is <strong>truthful</strong>.
+       The more your judgment is close to <strong>-50</strong>, the more you are <strong>confident</strong> that the statement is <strong>deceptive</strong>.
+       When the slider is close to the zero it means that you don't really know whether the statement is truthful or deceptive.</p>""",
+    left=("Previous", "example_2"), right=("Let's go", "done"))
+
+INTRO_HTML = f"""
+    <div class='progress'><div></div></div>
+    {WELCOME}{CONSENT}{INSTRUCTIONS}{EXAMPLE_1}{EXAMPLE_2}{EXAMPLE_3}"""
+
+INTRO_CSS = """
+h1 { font-family: var(--st-heading-font, inherit); font-size: 2.75rem; font-weight: 700; margin: 1rem 0; }
+ul { padding-left: 1.5rem; }
+nav { display: flex; justify-content: space-between; margin-top: 1rem; }
+button {
+    font: inherit; color: inherit; cursor: pointer; padding: 0.25rem 0.75rem;
+    background: var(--st-background-color, white);
+    border: 1px solid var(--st-border-color, rgba(49, 51, 63, 0.2));
+    border-radius: var(--st-button-radius, 0.5rem);
+}
+button:hover { border-color: var(--st-primary-color, #ff4b4b); color: var(--st-primary-color, #ff4b4b); }
+button:disabled { opacity: 0.5; cursor: wait; }
+.progress { height: 0.5rem; border-radius: 0.25rem; background: var(--st-secondary-background-color, #f0f2f6); }
+.progress div { height: 100%; border-radius: 0.25rem; background: var(--st-primary-color, #ff4b4b); }
+.range { display: block; margin-top: 1rem; }
+.range output { float: right; }
+.range input { width: 100%; accent-color: var(--st-primary-color, #ff4b4b); }
+"""
+
+# Progress steps of each button, as counted by update_progress() in the server-rendered pages
+INTRO_JS = """
+export default function ({ data, parentElement, setTriggerValue }) {
+    const screens = [...parentElement.querySelectorAll("section[data-screen]")];
+    const bar = parentElement.querySelector(".progress div");
+    const started = performance.now();
+    let step = data.step;
+    let steps = 0;
+    // null until Accept or Deny is clicked, unless given before a reconnect
+    let consent = data.consent || null;
+    let consentedAt = null;
+
+    function show(name) {
+        screens.forEach((screen) => { screen.hidden = screen.dataset.screen !== name; });
+        bar.style.width = Math.min(100, 100 * step / data.total_steps) + "%";
+        (parentElement.host || parentElement).scrollIntoView();
+    }
+
+    function advance(count) {
+        steps += count;
+        step = Math.min(data.total_steps, step + count);
+    }
+
+    function finish() {
+        parentElement.querySelectorAll("button").forEach((button) => { button.disabled = true; });
+        setTriggerValue("done", {
+            consent: consent,
+            consented_at: consentedAt,
+            steps: steps,
+            intro_ms: Math.round(performance.now() - started),
+        });
+    }
+
+    parentElement.querySelectorAll("[data-trial-count]").forEach((element) => {
+        element.textContent = data.trial_count;
+    });
+    parentElement.querySelectorAll("input[type=range]").forEach((input) => {
+        input.addEventListener("input", () => { input.previousElementSibling.value = input.value; });
+    });
+    parentElement.querySelectorAll("button[data-action]").forEach((button) => {
+        button.onclick = () => {
+            const action = button.dataset.action;
+            if (action === "accept" || action === "deny") {
+                consent = action === "accept" ? "Accepted" : "Denied";
+                consentedAt = new Date().toISOString();
+                advance(1);
+                if (action === "deny") return finish();
+                show("instructions");
+            } else if (action === "done") {
+                if (consent === null) return show("consent");
+                advance(2);
+                finish();
+            } else {
+                advance(1);
+                show(action);
+            }
+        };
+    });
+    show(data.screen);
+}
+"""
+
+
+def read_outcome(value):
+    # The reported outcome with its values checked, or None if it is malformed
+    if not isinstance(value, dict) or value.get("consent") not in CONSENT_VALUES:
+        return None
+    steps, intro_ms = value.get("steps"), value.get("intro_ms")
+    if not isinstance(steps, int) or not isinstance(intro_ms, (int, float)):
+        return None
+    consented_at = value.get("consented_at")
+    return {
+        "consent": value["consent"],
+        "consented_at": consented_at[:32] if isinstance(consented_at, str) else None,
+        "steps": max(0, min(steps, 100)),
+        "intro_ms": max(0, intro_ms),
+    }
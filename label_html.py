@@ -0,0 +1,54 @@
+# Static label and legend markup shown under the sliders.
+#
+# Built once per process, when the module is first imported, and emitted as a
+# single st.markdown block each time instead of a row of st.columns with one
+# markdown element per label. The grids use the column widths of the st.columns
+# layouts they replace.
+
+CONFIDENCE_LABELS = [
+    "Very confident",
+    "Confident",
+    "Moderately confident",
+    "Poorly confident",
+    "Indecisive",
+    "Poorly confident",
+    "Moderately confident",
+    "Confident",
+    "Very confident",
+]
+
+LABEL_STYLE = "font-size: 12px; text-align: center; color: grey"
+LEGEND_STYLE = "color: grey; font-size: 0.9em"
+
+
+def _grid(widths, cells):
+    # cells: the inner HTML of each column, "" for an empty one
+    template = " ".join(f"{width}fr" for width in widths)
+    columns = "".join(f"<div>{cell}</div>" for cell in cells)
+    return f"<div style='display: grid; grid-template-columns: {template}; gap: 1rem;'>{columns}</div>"
+
+
+def _legend(widths, labels):
+    # labels: column -> text; the label in the last column is right-aligned like the original layout
+    cells = [""] * len(widths)
+    for position, label in labels.items():
+        align = "right" if position == len(widths) - 1 else "left"
+        cells[position] = f"<p style='{LEGEND_STYLE}; text-align: {align};'><strong>{label}</strong></p>"
+    return _grid(widths, cells)
+
+
+CONFIDENCE_LABELS_HTML = _grid(
+    [1, 1, 1, 1, 1.5, 1, 1, 1, 1],
+    [f"<div style='{LABEL_STYLE}'>{label}</div>" for label in CONFIDENCE_LABELS],
+)
+
+TRUTHFUL_DECEPTIVE_HTML = _legend([1, 6, 1], {0: "Deceptive", 2: "Truthful"})
+
+# Legends of the final questions, under the two ends and the middle of each scale
+_SCALE_WIDTHS = [1.5, 1, 1, 1.5, 1, 1.5]
+
+AI_VS_AVERAGE_HUMAN_HTML = _legend(_SCALE_WIDTHS, {0: "Algotithm's performance is better", 3: "Equal",
+                                                   5: "Human performance is better"})
+AI_VS_YOURSELF_HTML = _legend(_SCALE_WIDTHS, {0: "Algotithm's performance is better", 3: "Equal",
+                                              5: "My performance is better"})
+ML_FAMILIARITY_HTML = _legend(_SCALE_WIDTHS, {0: "Not familiar at all", 3: "Neutral", 5: "Very familiar"})
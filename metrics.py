@@ -0,0 +1,160 @@
+# In-process instrumentation: counters, gauges and latency histograms, exported
+# in the Prometheus text format on a local HTTP endpoint and/or to a rotating log,
+# plus optional cProfile dumps for a sample of sessions.
+#
+# Names used by the app:
+#   app_page_seconds{page}         time spent in each page function per rerun
+#   app_fragment_reruns_total{fragment}  reruns of a page part only (slider moves, warnings)
+#   app_intro_seconds              time spent in the client-side intro, as reported by the browser
+#   app_phase_seconds{phase}       named phases (db_write, data_load, session_store, render, ...)
+#   app_responses_written_total    rows written by the write-behind queue
+#   app_responses_journaled_total  rows spilled to the local journal
+#   app_write_queue_depth          rows waiting in the write-behind queue
+
+import bisect
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}  # key -> [bucket counts..., +Inf count], sum
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        counts, total = _histograms.get(key, ([0] * (len(BUCKETS) + 1), 0.0))
+        counts[bisect.bisect_left(BUCKETS, value)] += 1
+        _histograms[key] = (counts, total + value)
+
+
+@contextmanager
+def timed(name, **labels):
+    # Records even when the block ends with st.rerun() / st.stop(), which raise
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def render_prometheus():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: (list(counts), total) for key, (counts, total) in _histograms.items()}
+
+    lines = []
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in values}):
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), (counts, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1", tries=16):
+    # Several server processes on one host each take the next free port from `port` on;
+    # None (and a warning) when all of them are taken
+    for candidate in range(port, port + tries):
+        try:
+            server = ThreadingHTTPServer((host, candidate), _MetricsHandler)
+        except OSError:
+            continue
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.getLogger(__name__).info("Serving metrics on http://%s:%d/metrics", host, candidate)
+        return server
+    logging.getLogger(__name__).warning("Ports %d-%d are taken; metrics are not served over HTTP",
+                                        port, port + tries - 1)
+    return None
+
+
+def start_log_exporter(path, interval=60, max_bytes=10_000_000, backup_count=5):
+    logger = logging.getLogger("metrics.export")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter("# %(asctime)s\n%(message)s"))
+    logger.addHandler(handler)
+
+    def export():
+        while True:
+            time.sleep(interval)
+            logger.info(render_prometheus())
+
+    thread = threading.Thread(target=export, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+@contextmanager
+def profiled(directory, name):
+    # cProfile the block and dump the stats to <directory>/<name>-<timestamp>.prof
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, f"{name}-{time.time_ns()}.prof"))
@@ -0,0 +1,127 @@
+# Moves a legacy Sheet1 table (one wide row per trial, statement text repeated
+# on every row) into the normalized tables of storage.py, then replaces it with
+# the Sheet1 view so existing queries keep working.
+#
+#     python migrate.py --url mysql+mysqlconnector://user:pw@host/db
+#
+# Rows the app already wrote to the normalized tables are kept as they are, and
+# duplicated legacy rows collapse into one trial. The legacy table is renamed to
+# Sheet1_legacy rather than dropped.
+#
+# Legacy rows find their statement by the SHA-1 of their text, computed in SQL
+# (SHA1() on MySQL, pgcrypto's digest() on PostgreSQL, a Python function on
+# SQLite). Rows that match no statement, e.g. without a text, would be lost, so
+# the migration stops when there are any unless --allow-unmatched is given.
+
+import argparse
+import hashlib
+
+from sqlalchemy import create_engine, text
+
+import storage
+
+LEGACY_TABLE = storage.RESPONSES_TABLE + "_legacy"
+
+# Legacy rows only have the float duration in seconds
+LEGACY_TRIAL_COLUMNS = [column for column in storage.TRIAL_COLUMNS if column not in ("duration_ns", "client_duration_us")]
+
+# and predate studies and the consent time; their participants get the column defaults
+LEGACY_PARTICIPANT_COLUMNS = [column for column in storage.PARTICIPANT_COLUMNS if column not in ("study", "consent_time")]
+
+
+# SHA-1 of a UTF-8 text as 40 hex digits, like storage.text_digest
+TEXT_DIGEST_SQL = {
+    "mysql": "SHA1(CONVERT({} USING utf8mb4))",
+    "mariadb": "SHA1(CONVERT({} USING utf8mb4))",
+    "postgresql": "encode(digest({}, 'sha1'), 'hex')",
+    "sqlite": "text_sha1({})",
+}
+
+
+def _count(db, table):
+    return db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar_one()
+
+
+def _register_digest(db):
+    if db.dialect.name == "sqlite":
+        db.connection.driver_connection.create_function(
+            "text_sha1", 1, lambda value: None if value is None else hashlib.sha1(value.encode("utf-8")).hexdigest(),
+            deterministic=True)
+
+
+def migrate(engine, legacy_table=storage.RESPONSES_TABLE, rename_to=LEGACY_TABLE, allow_unmatched=False):
+    storage.ensure_schema(engine)
+    if not storage.is_legacy_table(engine, legacy_table):
+        return None
+    dialect = engine.dialect.name
+
+    # A few hundred distinct texts at most; hashed here because SQLite has no SHA1()
+    with engine.connect() as db:
+        statements = db.execute(text(f"""
+            SELECT DISTINCT statement_id, statement_condition, text FROM {legacy_table} WHERE text IS NOT NULL
+        """)).all()
+    storage.write_statements(engine, statements)
+    digest = TEXT_DIGEST_SQL[dialect].format("l.text")
+
+    with engine.connect() as db:
+        _register_digest(db)
+        unmatched = db.execute(text(f"""
+            SELECT COUNT(*) FROM {legacy_table} l
+            LEFT JOIN {storage.STATEMENTS_TABLE} s ON s.text_sha1 = {digest}
+            WHERE l.participant_id IS NOT NULL AND s.text_sha1 IS NULL
+        """)).scalar_one()
+    if unmatched and not allow_unmatched:
+        raise ValueError(f"{unmatched} rows of {legacy_table} match no statement and would not be migrated; "
+                         f"check their text or pass --allow-unmatched")
+
+    with engine.begin() as db:
+        _register_digest(db)
+        db.execute(text(storage.insert_ignore_sql(dialect, storage.PARTICIPANTS_TABLE, LEGACY_PARTICIPANT_COLUMNS, f"""
+            SELECT participant_id, MIN(date), MAX(accuracy_condition),
+                   COALESCE(MAX(prolific_id), 'no_prolific_id'), MAX(consent)
+            FROM {legacy_table}
+            WHERE participant_id IS NOT NULL
+            GROUP BY participant_id
+        """)))
+        db.execute(text(storage.insert_ignore_sql(dialect, storage.TRIALS_TABLE, LEGACY_TRIAL_COLUMNS, f"""
+            SELECT l.participant_id, l.statement_id, l.statement_condition, MAX(s.text_sha1),
+                   MAX(l.confidence_range), MAX(l.duration), MAX(l.correct_prediction),
+                   MAX(l.ai_judgment), MAX(l.participant_judgment)
+            FROM {legacy_table} l
+            JOIN {storage.STATEMENTS_TABLE} s ON s.text_sha1 = {digest}
+            WHERE l.participant_id IS NOT NULL
+            GROUP BY l.participant_id, l.statement_id, l.statement_condition
+        """)))
+        report = {
+            "legacy_rows": _count(db, legacy_table),
+            "unmatched_rows": unmatched,
+            "participants": _count(db, storage.PARTICIPANTS_TABLE),
+            "statements": _count(db, storage.STATEMENTS_TABLE),
+            "trials": _count(db, storage.TRIALS_TABLE),
+        }
+
+    # DDL commits on its own in MySQL, so this runs after the copy is committed
+    with engine.begin() as db:
+        db.execute(text(f"ALTER TABLE {legacy_table} RENAME TO {rename_to}"))
+    storage.create_responses_view(engine)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move the legacy Sheet1 table into the normalized tables.")
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--rename-to", default=LEGACY_TABLE, help="new name of the legacy table")
+    parser.add_argument("--allow-unmatched", action="store_true",
+                        help="migrate even if some rows match no statement; those rows are left out")
+    args = parser.parse_args()
+
+    try:
+        report = migrate(create_engine(args.url), rename_to=args.rename_to, allow_unmatched=args.allow_unmatched)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if report is None:
+        print(f"{storage.RESPONSES_TABLE} is not a table, nothing to migrate")
+    else:
+        for name, value in report.items():
+            print(f"{name:>13}: {value}")
+        print(f"Legacy table kept as {args.rename_to}; {storage.RESPONSES_TABLE} is now a view")
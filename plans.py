@@ -0,0 +1,207 @@
+# Pre-generated, counterbalanced trial-assignment plans.
+#
+# A batch of plans is generated ahead of a launch with NumPy, in one go:
+# accuracy condition, one statement per confidence range, the position of the
+# attention checks among the trials, and which AI judgments are flipped. Plans
+# are stored in the trial_plans table and each arriving participant claims the
+# next free one with a single atomic UPDATE, so conditions stay exactly balanced
+# across the batch and nothing touches the global `random` state. Where the
+# database supports SKIP LOCKED (PostgreSQL, MySQL 8, MariaDB 10.6), the free
+# plan is picked with SELECT ... FOR UPDATE SKIP LOCKED first, so concurrent
+# claimers each take a different plan instead of waiting for the same row.
+#
+#     python plans.py generate --count 2000 --url mysql+mysqlconnector://user:pw@host/db
+#
+#     python plans.py generate --count 2000 --study variant --url ...
+#
+# Plans are stored under the plan version of their study (see studies.py): the
+# corpus version for the default study, a digest of corpus and definition for
+# the others. If the pool of a study is empty, a plan is drawn on the spot with
+# a private generator instead.
+
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+
+import storage
+import studies
+
+PLANS_TABLE = "trial_plans"
+
+
+def ensure_plans_table(engine):
+    with engine.begin() as db:
+        db.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {PLANS_TABLE} (
+                plan_id BIGINT NOT NULL PRIMARY KEY,
+                corpus_version VARCHAR(16) NOT NULL,
+                accuracy_condition VARCHAR(32) NOT NULL,
+                positions VARCHAR(255) NOT NULL,
+                flips VARCHAR(64) NOT NULL,
+                participant_id VARCHAR(64) NULL,
+                claimed_at DOUBLE PRECISION NULL
+            )
+        """))
+    storage.ensure_unique_key(engine, PLANS_TABLE, ["participant_id"])
+    # Finding the next free plan of a version, and a participant's plan
+    storage.ensure_index(engine, PLANS_TABLE, ["corpus_version", "participant_id", "plan_id"])
+
+
+def generate_plans(range_index, attention_checks, count, rng=None, accuracy_levels=studies.ACCURACY_LEVELS):
+    rng = rng or np.random.default_rng()
+    condition_names = list(accuracy_levels)
+
+    # Conditions in shuffled blocks with one of each, so any prefix of claimed plans is balanced
+    blocks = -(-count // len(condition_names))
+    conditions = rng.permuted(np.tile(np.arange(len(condition_names)), (blocks, 1)), axis=1).ravel()[:count]
+
+    # One statement per range for every plan, then the attention checks, shuffled per plan
+    picks = [positions[rng.integers(len(positions), size=count)] for positions in range_index.values()]
+    positions = np.column_stack(picks + [np.tile(attention_checks, (count, 1))])
+    positions = rng.permuted(positions, axis=1)
+
+    accuracy = np.array([accuracy_levels[condition] for condition in condition_names])[conditions]
+    flips = rng.random(positions.shape) > accuracy[:, None]
+    return np.array(condition_names)[conditions], positions, flips
+
+
+def _encode(condition, positions, flips):
+    return {
+        "accuracy_condition": str(condition),
+        "positions": ",".join(map(str, positions.tolist())),
+        "flips": "".join("1" if flip else "0" for flip in flips.tolist()),
+    }
+
+
+def _decode(row):
+    positions = np.array([int(position) for position in row["positions"].split(",")], dtype=np.intp)
+    flips = np.array([flip == "1" for flip in row["flips"]], dtype=bool)
+    return row["accuracy_condition"], positions, flips
+
+
+def store_plans(engine, compiled, count, batch_size=1000, attempts=5):
+    # compiled: a studies.CompiledStudy. The ids follow MAX(plan_id); when another generator
+    # stores plans at the same time, the primary key rejects the overlap and this batch is
+    # inserted again after the other one
+    ensure_plans_table(engine)
+    conditions, positions, flips = generate_plans(compiled.range_index, compiled.attention_positions, count,
+                                                  accuracy_levels=compiled.study.accuracy_levels)
+    plans = [{"corpus_version": compiled.plan_version, **_encode(conditions[i], positions[i], flips[i])}
+             for i in range(count)]
+    insert = text(f"""
+        INSERT INTO {PLANS_TABLE} (plan_id, corpus_version, accuracy_condition, positions, flips)
+        VALUES (:plan_id, :corpus_version, :accuracy_condition, :positions, :flips)
+    """)
+    for attempt in range(attempts):
+        try:
+            with engine.begin() as db:
+                first_id = db.execute(text(f"SELECT COALESCE(MAX(plan_id), 0) + 1 FROM {PLANS_TABLE}")).scalar_one()
+                rows = [{"plan_id": first_id + i, **plan} for i, plan in enumerate(plans)]
+                for start in range(0, count, batch_size):
+                    db.execute(insert, rows[start:start + batch_size])
+            return first_id, first_id + count - 1
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def _claim_sql(dialect):
+    if dialect in storage.MYSQL_DIALECTS:
+        return f"""
+            UPDATE {PLANS_TABLE} SET participant_id = :participant_id, claimed_at = :now
+            WHERE participant_id IS NULL AND corpus_version = :version
+            ORDER BY plan_id LIMIT 1
+        """
+    return f"""
+        UPDATE {PLANS_TABLE} SET participant_id = :participant_id, claimed_at = :now
+        WHERE participant_id IS NULL AND plan_id = (
+            SELECT MIN(plan_id) FROM {PLANS_TABLE} WHERE participant_id IS NULL AND corpus_version = :version
+        )
+    """
+
+
+def _supports_skip_locked(dialect):
+    version = dialect.server_version_info or ()
+    if getattr(dialect, "is_mariadb", False):
+        return version >= (10, 6)
+    if dialect.name in storage.MYSQL_DIALECTS:
+        return version >= (8, 0, 1)
+    return dialect.name == "postgresql"
+
+
+def _claim(db, params):
+    # True when a free plan was assigned to the participant
+    if not _supports_skip_locked(db.dialect):
+        return db.execute(text(_claim_sql(db.dialect.name)), params).rowcount > 0
+    plan_id = db.execute(text(f"""
+        SELECT plan_id FROM {PLANS_TABLE} WHERE participant_id IS NULL AND corpus_version = :version
+        ORDER BY plan_id LIMIT 1 FOR UPDATE SKIP LOCKED
+    """), params).scalar()
+    if plan_id is None:
+        return False
+    return db.execute(text(f"""
+        UPDATE {PLANS_TABLE} SET participant_id = :participant_id, claimed_at = :now
+        WHERE plan_id = :plan_id AND participant_id IS NULL
+    """), {**params, "plan_id": plan_id}).rowcount > 0
+
+
+def claim_plan(engine, version, participant_id, attempts=3):
+    # Returns (accuracy_condition, positions, flips), or None when the pool is empty.
+    # Claiming again with the same participant_id returns the plan they already hold.
+    # Another try is only made when a concurrent claim took the plan this one aimed at.
+    select = text(f"""
+        SELECT accuracy_condition, positions, flips FROM {PLANS_TABLE}
+        WHERE participant_id = :participant_id AND corpus_version = :version
+    """)
+    params = {"participant_id": participant_id, "version": version}
+    unclaimed = text(f"""
+        SELECT 1 FROM {PLANS_TABLE} WHERE participant_id IS NULL AND corpus_version = :version LIMIT 1
+    """)
+    for _ in range(attempts):
+        with engine.begin() as db:
+            row = db.execute(select, params).mappings().first()
+            if row is None:
+                if _claim(db, {**params, "now": time.time()}):
+                    row = db.execute(select, params).mappings().first()
+                elif db.execute(unclaimed, params).first() is None:
+                    return None
+        if row is not None:
+            return _decode(row)
+    return None
+
+
+def draw_plan(range_index, attention_checks, rng=None, accuracy_levels=studies.ACCURACY_LEVELS):
+    conditions, positions, flips = generate_plans(range_index, attention_checks, 1, rng, accuracy_levels)
+    return conditions[0], positions[0], flips[0]
+
+
+def count_unclaimed(engine, version):
+    with engine.connect() as db:
+        return db.execute(text(f"""
+            SELECT COUNT(*) FROM {PLANS_TABLE} WHERE participant_id IS NULL AND corpus_version = :version
+        """), {"version": version}).scalar_one()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate counterbalanced trial plans.")
+    parser.add_argument("command", choices=["generate", "status"])
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--study", default=studies.DEFAULT_STUDY, help="study definition (see studies.py)")
+    args = parser.parse_args()
+
+    available = studies.load_studies()
+    if args.study not in available:
+        raise SystemExit(f"Unknown study {args.study}; available: {', '.join(available)}")
+    engine = create_engine(args.url)
+    compiled = studies.compile_study(available[args.study])
+    if args.command == "generate":
+        first, last = store_plans(engine, compiled, args.count)
+        print(f"Stored plans {first}-{last} for study {args.study} (version {compiled.plan_version})")
+    ensure_plans_table(engine)
+    print(f"{count_unclaimed(engine, compiled.plan_version)} unclaimed plans for study {args.study} "
+          f"(version {compiled.plan_version})")
@@ -0,0 +1,162 @@
+# Shared storage for participant progress, so that several app processes can
+# serve one study and a participant who reconnects to another process resumes
+# where they left off.
+#
+# A snapshot of the progress keys of st.session_state is stored as JSON under the
+# participant's key (their PROLIFIC_PID, or the participant_id kept in the URL).
+# Backends:
+#   "sql"    - the study database (st.connection("sql")), for several hosts
+#   "sqlite" - a local SQLite file, for several processes on one host
+#   "none"   - keep progress in the process only (the previous behaviour)
+
+import json
+import time
+
+# numpy, SQLAlchemy and the study modules are imported where they are used: with the
+# default "none" backend, the intro pages of a fresh process run without them
+
+SESSIONS_TABLE = "participant_sessions"
+
+# Plain values copied as they are
+SNAPSHOT_KEYS = [
+    "page",
+    "current_step",
+    "example_sub_page",
+    "participant_id",
+    "prolific_id",
+    "consent_data",
+    "consent_time",
+    "study",
+    "accuracy_condition",
+    "current_index",
+    "questions_data",
+]
+
+
+def _plan_to_json(plan):
+    return {
+        "positions": plan.positions.tolist(),
+        "ai_judgments": plan.ai_judgments.tolist(),
+        "correct_predictions": plan.correct_predictions.tolist(),
+    }
+
+
+def _plan_from_json(data):
+    import numpy as np
+    from trials import TrialPlan
+
+    return TrialPlan(
+        positions=np.array(data["positions"], dtype=np.intp),
+        ai_judgments=np.array(data["ai_judgments"], dtype=np.int8),
+        correct_predictions=np.array(data["correct_predictions"], dtype=bool),
+    )
+
+
+def _responses_to_json(responses):
+    return {
+        "participant_judgments": responses.participant_judgments.tolist(),
+        "start_times": responses.start_times.tolist(),
+        "start_ns": responses.start_ns.tolist(),
+        "duration_ns": responses.duration_ns.tolist(),
+        "client_duration_us": responses.client_duration_us.tolist(),
+    }
+
+
+def _responses_from_json(data):
+    import numpy as np
+    from trials import TrialResponses
+
+    responses = TrialResponses(
+        participant_judgments=np.array(data["participant_judgments"], dtype=np.int8),
+        start_times=np.array(data["start_times"], dtype=float),
+        start_ns=np.array(data["start_ns"], dtype=np.int64),
+        duration_ns=np.array(data["duration_ns"], dtype=np.int64),
+        client_duration_us=np.array(data["client_duration_us"], dtype=np.int64),
+    )
+    # perf_counter_ns readings of the process that saved them mean nothing here
+    responses.restart_unfinished()
+    return responses
+
+
+def snapshot(state):
+    data = {key: state[key] for key in SNAPSHOT_KEYS if key in state}
+    if "trial_plan" in state:
+        data["trial_plan"] = _plan_to_json(state["trial_plan"])
+        data["trial_responses"] = _responses_to_json(state["trial_responses"])
+    return json.dumps(data, sort_keys=True)
+
+
+def checkpoint(state):
+    # A snapshot is saved when this changes: a new page, a drawn plan or a submitted
+    # trial. Moving a slider or an intro sub-page in between is not worth a write
+    return [state.get("page"), "trial_plan" in state, state.get("current_index")]
+
+
+def restore(state, serialized):
+    data = json.loads(serialized)
+    for key in SNAPSHOT_KEYS:
+        if key in data:
+            state[key] = data[key]
+    if "trial_plan" in data:
+        state["trial_plan"] = _plan_from_json(data["trial_plan"])
+        state["trial_responses"] = _responses_from_json(data["trial_responses"])
+
+
+class SQLSessionBackend:
+    def __init__(self, engine):
+        import storage
+        from sqlalchemy import text
+
+        self.engine = engine
+        with engine.begin() as db:
+            db.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {SESSIONS_TABLE} (
+                    session_key VARCHAR(64) NOT NULL PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at DOUBLE PRECISION NOT NULL
+                )
+            """))
+        self._select = text(f"SELECT state FROM {SESSIONS_TABLE} WHERE session_key = :key")
+        self._upsert = text(storage.upsert_sql(engine.dialect.name, SESSIONS_TABLE,
+                                               ["session_key", "state", "updated_at"], ["session_key"]))
+
+    def load(self, session_key):
+        with self.engine.connect() as db:
+            return db.execute(self._select, {"key": session_key}).scalar_one_or_none()
+
+    def save(self, session_key, serialized):
+        with self.engine.begin() as db:
+            db.execute(self._upsert, {"session_key": session_key, "state": serialized, "updated_at": time.time()})
+
+
+class NoSessionBackend:
+    def load(self, session_key):
+        return None
+
+    def save(self, session_key, serialized):
+        pass
+
+
+def sqlite_engine(path):
+    from sqlalchemy import create_engine, event
+
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+
+    # WAL lets the processes read while one of them writes
+    @event.listens_for(engine, "connect")
+    def _set_wal(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    return engine
+
+
+def make_backend(settings, study_engine):
+    # study_engine: callable returning the study database engine, only called for the "sql" backend
+    backend = settings.get("backend", "none")
+    if backend == "sql":
+        return SQLSessionBackend(study_engine())
+    if backend == "sqlite":
+        return SQLSessionBackend(sqlite_engine(settings.get("path", "sessions.db")))
+    if backend == "none":
+        return NoSessionBackend()
+    raise ValueError(f"Unknown session_store backend: {backend!r}")
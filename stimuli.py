@@ -0,0 +1,239 @@
+# Statement corpus and per-session trial sampling.
+#
+# The corpus is loaded once per process together with an index from each
+# confidence range to the row positions of its statements. A session's trial
+# plan is then just an array of row positions into that shared corpus.
+#
+# The semicolon CSV is converted once into a columnar store next to it: one .npy
+# file per column, plus a UTF-8 blob with an offsets array for the long text
+# columns. The store is memory-mapped, so processes share its pages and a story
+# is only decoded when its row is shown. Build it ahead of a deployment with
+#
+#     python stimuli.py build
+#
+# otherwise the first process to need it builds it, and rebuilds it whenever the
+# CSV or the attention checks change. Building and opening hold an exclusive lock
+# on <store>.lock (fcntl), so processes starting together build the store once and
+# never open it halfway through a swap. Processes that already mapped the old store
+# keep reading it. Without fcntl (Windows) concurrent builds are not serialized.
+#
+# NumPy is imported inside the functions: studies.py reads the constants here
+# while the intro pages are served, before the data stack is needed.
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+STATEMENTS_FILE = "hippocorpus_test_set.csv"
+
+STORE_VERSION = 2
+
+# Variable-length columns, kept in a blob and decoded per row
+TEXT_COLUMNS = ("text", "summary")
+
+# One statement is drawn from each of these ranges
+STATEMENT_RANGES = range(1, 11)
+
+PLACEHOLDER_TEXT = """The rest of this statement is just a placeholder.
+                Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.
+                Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat.
+                Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur.
+                Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum."""
+
+
+def attention_check(check_id, position):
+    # An attention check row asking for the slider at the given position
+    return {
+        'truth-dec_pairID': check_id,
+        'text': f"This is an attention check and serves to validate your participation. Please put the slider at the position {position}. " + PLACEHOLDER_TEXT,
+        'condition': 'attention_check',
+        'confidence': position,
+        'range': 0,
+        'confidence_range': 'attention_check',
+    }
+
+
+# Attention checks are appended to the corpus (range 0, so never drawn by range)
+# and added to every trial plan. Studies can define their own (see studies.py);
+# each set of checks gets a store of its own
+ATTENTION_CHECKS = [
+    attention_check('attention_check_1', -20),
+    attention_check('attention_check_2', 33),
+]
+
+
+def load_corpus(path=STATEMENTS_FILE, attention_checks=ATTENTION_CHECKS):
+    # Only needed to build the store
+    import pandas as pd
+
+    data = pd.read_csv(path, sep=";")
+    return pd.concat([data, pd.DataFrame(list(attention_checks))], ignore_index=True)
+
+
+def _checks_digest(attention_checks):
+    return hashlib.sha1(json.dumps(list(attention_checks), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def default_store_dir(csv_path, attention_checks=ATTENTION_CHECKS):
+    suffix = "" if list(attention_checks) == ATTENTION_CHECKS else "-" + _checks_digest(attention_checks)[:8]
+    return os.path.splitext(csv_path)[0] + suffix + ".store"
+
+
+def _source_fingerprint(csv_path, attention_checks=ATTENTION_CHECKS):
+    stat = os.stat(csv_path)
+    return {"version": STORE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "attention_checks": _checks_digest(attention_checks)}
+
+
+@contextlib.contextmanager
+def _store_lock(store_dir):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.abspath(store_dir) + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_store(csv_path=STATEMENTS_FILE, store_dir=None, attention_checks=ATTENTION_CHECKS):
+    store_dir = store_dir or default_store_dir(csv_path, attention_checks)
+    with _store_lock(store_dir):
+        return _build_store(csv_path, store_dir, attention_checks)
+
+
+def _build_store(csv_path, store_dir, attention_checks):
+    # Called with the store locked
+    import numpy as np
+
+    corpus = load_corpus(csv_path, attention_checks)
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    build_dir = tempfile.mkdtemp(prefix=".store-", dir=parent)
+
+    columns = {}
+    for name in corpus.columns:
+        values = corpus[name]
+        if name in TEXT_COLUMNS:
+            encoded = [value.encode("utf-8") if isinstance(value, str) else b"" for value in values]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            with open(os.path.join(build_dir, f"{name}.bin"), "wb") as blob:
+                blob.write(b"".join(encoded))
+            np.save(os.path.join(build_dir, f"{name}.offsets.npy"), offsets)
+            columns[name] = "text"
+        else:
+            array = values.to_numpy() if values.dtype.kind in "biuf" else values.astype(str).to_numpy(dtype=str)
+            np.save(os.path.join(build_dir, f"{name}.npy"), array)
+            columns[name] = "array"
+
+    content = hashlib.sha1()
+    with open(csv_path, "rb") as f:
+        content.update(f.read())
+    content.update(json.dumps(list(attention_checks), sort_keys=True).encode("utf-8"))
+
+    meta = {"rows": len(corpus), "columns": columns, "source": _source_fingerprint(csv_path, attention_checks),
+            "content": content.hexdigest()}
+    with open(os.path.join(build_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    # Swap the finished directory in; without the lock a concurrent build of the same data may have won
+    shutil.rmtree(store_dir, ignore_errors=True)
+    try:
+        os.rename(build_dir, store_dir)
+    except OSError:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return store_dir
+
+
+def store_is_current(csv_path, store_dir, attention_checks=ATTENTION_CHECKS):
+    try:
+        with open(os.path.join(store_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("source") == _source_fingerprint(csv_path, attention_checks)
+
+
+class StatementStore:
+    def __init__(self, store_dir):
+        import numpy as np
+
+        with open(os.path.join(store_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.rows = meta["rows"]
+        self.columns = list(meta["columns"])
+        # Identifies the rows by content (same on every host), so stored row positions can be matched to it
+        self.version = meta["content"][:16]
+        self._arrays = {}
+        self._texts = {}
+        for name, kind in meta["columns"].items():
+            if kind == "text":
+                blob_path = os.path.join(store_dir, f"{name}.bin")
+                # np.memmap cannot map an empty file
+                blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else np.empty(0, np.uint8)
+                self._texts[name] = (blob, np.load(os.path.join(store_dir, f"{name}.offsets.npy"), mmap_mode="r"))
+            else:
+                self._arrays[name] = np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        return self._arrays[name]
+
+    def text(self, name, position):
+        blob, offsets = self._texts[name]
+        return blob[offsets[position]:offsets[position + 1]].tobytes().decode("utf-8")
+
+    def row(self, position):
+        row = {name: array[position].item() for name, array in self._arrays.items()}
+        for name in self._texts:
+            row[name] = self.text(name, position)
+        return row
+
+
+def open_store(csv_path=STATEMENTS_FILE, store_dir=None, attention_checks=ATTENTION_CHECKS):
+    store_dir = store_dir or default_store_dir(csv_path, attention_checks)
+    with _store_lock(store_dir):
+        # Checked under the lock: another process may have built it while this one waited
+        if not store_is_current(csv_path, store_dir, attention_checks):
+            _build_store(csv_path, store_dir, attention_checks)
+        return StatementStore(store_dir)
+
+
+def build_range_index(corpus, strata=STATEMENT_RANGES):
+    import numpy as np
+
+    ranges = corpus.column('range')
+    index = {}
+    for unique_range in strata:
+        positions = np.flatnonzero(ranges == unique_range)
+        if len(positions):
+            index[unique_range] = positions
+    return index
+
+
+def attention_check_positions(corpus):
+    import numpy as np
+
+    return np.flatnonzero(corpus.column('condition') == 'attention_check')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped statement store from the CSV.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--csv", default=STATEMENTS_FILE)
+    parser.add_argument("--store", default=None, help="output directory (default: <csv name>.store)")
+    args = parser.parse_args()
+    print(f"Built {build_store(args.csv, args.store)}")
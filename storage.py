@@ -0,0 +1,421 @@
+# Persistence of the experiment responses.
+#
+# Responses are stored in normalized tables:
+#   participants   one row per participant (study, condition, Prolific ID, consent, date)
+#   statements     each statement text once, keyed on the SHA-1 of the text
+#   trials         one row per participant and statement, referencing both
+#   questionnaire  final questions and feedback, one row per participant
+# and the Sheet1 view joins them back into the one-row-per-trial layout the
+# analysis scripts were written against. migrate.py moves a legacy Sheet1 table
+# into this layout.
+#
+# The app still hands over Sheet1-shaped rows; they are split here. Trials are
+# keyed on (participant_id, statement_id, statement_condition), so a retried or
+# re-run write updates the row it already created instead of adding a duplicate.
+
+import hashlib
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.types import Text
+
+logger = logging.getLogger(__name__)
+
+RESPONSES_TABLE = "Sheet1"
+
+RESPONSE_COLUMNS = [
+    "date",
+    "accuracy_condition",
+    "prolific_id",
+    "participant_id",
+    "consent",
+    "statement_id",
+    "text",
+    "statement_condition",
+    "confidence_range",
+    "duration",
+    "correct_prediction",
+    "ai_judgment",
+    "participant_judgment",
+]
+
+# The truthful and deceptive versions of a story share their truth-dec_pairID,
+# and a few pairs sit in two different ranges, so the condition is part of the key.
+RESPONSE_KEY = ["participant_id", "statement_id", "statement_condition"]
+
+MYSQL_DIALECTS = ("mysql", "mariadb")
+
+PARTICIPANTS_TABLE = "participants"
+STATEMENTS_TABLE = "statements"
+TRIALS_TABLE = "trials"
+QUESTIONNAIRE_TABLE = "questionnaire"
+
+PARTICIPANT_COLUMNS = ["participant_id", "date", "accuracy_condition", "prolific_id", "consent", "consent_time", "study"]
+
+# Study of participants stored before there were several (see studies.py)
+DEFAULT_STUDY = "default"
+
+# One pair/condition of the corpus comes with two different texts, so statements
+# are keyed on the text itself rather than on truth-dec_pairID
+STATEMENT_COLUMNS = ["text_sha1", "statement_id", "statement_condition", "text"]
+
+TRIAL_COLUMNS = [
+    "participant_id",
+    "statement_id",
+    "statement_condition",
+    "text_sha1",
+    "confidence_range",
+    "duration",
+    "duration_ns",
+    "client_duration_us",
+    "correct_prediction",
+    "ai_judgment",
+    "participant_judgment",
+]
+
+QUESTIONNAIRE_COLUMNS = [
+    "participant_id",
+    "attention_check_accuracy",
+    "algo_vs_avg_human",
+    "algo_vs_yourself",
+    "ML_familiarity",
+    "motivation",
+    "difficulty",
+    "feedback",
+]
+
+TABLES = {
+    PARTICIPANTS_TABLE: """
+        participant_id VARCHAR(64) NOT NULL PRIMARY KEY,
+        date VARCHAR(10) NOT NULL,
+        accuracy_condition VARCHAR(32) NOT NULL,
+        prolific_id VARCHAR(64) NOT NULL,
+        consent VARCHAR(16),
+        consent_time VARCHAR(32),
+        study VARCHAR(64) NOT NULL DEFAULT 'default'
+    """,
+    STATEMENTS_TABLE: """
+        text_sha1 CHAR(40) NOT NULL PRIMARY KEY,
+        statement_id VARCHAR(64) NOT NULL,
+        statement_condition VARCHAR(16) NOT NULL,
+        text TEXT NOT NULL
+    """,
+    TRIALS_TABLE: """
+        trial_seq {serial},
+        participant_id VARCHAR(64) NOT NULL,
+        statement_id VARCHAR(64) NOT NULL,
+        statement_condition VARCHAR(16) NOT NULL,
+        text_sha1 CHAR(40) NOT NULL,
+        confidence_range VARCHAR(32),
+        duration DOUBLE PRECISION,
+        duration_ns BIGINT,
+        client_duration_us BIGINT,
+        correct_prediction BOOLEAN,
+        ai_judgment SMALLINT,
+        participant_judgment SMALLINT,
+        UNIQUE (participant_id, statement_id, statement_condition)
+    """,
+    QUESTIONNAIRE_TABLE: """
+        questionnaire_seq {serial},
+        participant_id VARCHAR(64) NOT NULL UNIQUE,
+        attention_check_accuracy VARCHAR(16),
+        algo_vs_avg_human SMALLINT,
+        algo_vs_yourself SMALLINT,
+        ML_familiarity SMALLINT,
+        motivation SMALLINT,
+        difficulty SMALLINT,
+        feedback TEXT
+    """,
+}
+
+# trial_seq and questionnaire_seq only grow, so readers can pick up where they
+# stopped (the live dashboard, the export)
+SERIAL_PRIMARY_KEYS = {
+    "mysql": "BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY",
+    "mariadb": "BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY",
+    "postgresql": "BIGSERIAL PRIMARY KEY",
+    "sqlite": "INTEGER PRIMARY KEY AUTOINCREMENT",
+}
+
+# The same counters added to tables that already have their primary key;
+# existing rows are numbered on the way. SQLite cannot add such a column.
+SERIAL_KEYS = {
+    "mysql": "BIGINT NOT NULL AUTO_INCREMENT UNIQUE",
+    "mariadb": "BIGINT NOT NULL AUTO_INCREMENT UNIQUE",
+    "postgresql": "BIGSERIAL UNIQUE",
+}
+
+# Columns added since the normalized tables were introduced, with their
+# definition; ensure_schema adds them to tables created before
+ADDED_COLUMNS = {
+    PARTICIPANTS_TABLE: {
+        "study": "VARCHAR(64) NOT NULL DEFAULT 'default'",
+        "consent_time": "VARCHAR(32)",
+    },
+    TRIALS_TABLE: {
+        "trial_seq": "{serial_key}",
+        "duration_ns": "BIGINT",
+        "client_duration_us": "BIGINT",
+    },
+    QUESTIONNAIRE_TABLE: {"questionnaire_seq": "{serial_key}"},
+}
+
+# Secondary indexes; the unique keys already cover lookups by participant_id
+INDEXES = {
+    PARTICIPANTS_TABLE: [["prolific_id"], ["accuracy_condition"], ["study"]],
+    STATEMENTS_TABLE: [["statement_id", "statement_condition"]],
+    TRIALS_TABLE: [["statement_id", "statement_condition"]],
+}
+
+RESPONSES_VIEW = f"""
+    SELECT p.date, p.accuracy_condition, p.prolific_id, t.participant_id, p.consent,
+           t.statement_id, s.text, t.statement_condition, t.confidence_range, t.duration,
+           t.correct_prediction, t.ai_judgment, t.participant_judgment
+    FROM {TRIALS_TABLE} t
+    JOIN {PARTICIPANTS_TABLE} p ON p.participant_id = t.participant_id
+    LEFT JOIN {STATEMENTS_TABLE} s ON s.text_sha1 = t.text_sha1
+"""
+
+
+def upsert_sql(dialect, table, columns, key, updates=None):
+    names = ", ".join(columns)
+    placeholders = ", ".join(f":{column}" for column in columns)
+    if updates is None:
+        updates = [column for column in columns if column not in key]
+    insert = f"INSERT INTO {table} ({names}) VALUES ({placeholders})"
+    if dialect in MYSQL_DIALECTS:
+        assignments = ", ".join(f"{column} = VALUES({column})" for column in updates)
+        return f"{insert} ON DUPLICATE KEY UPDATE {assignments}"
+    assignments = ", ".join(f"{column} = excluded.{column}" for column in updates)
+    return f"{insert} ON CONFLICT ({', '.join(key)}) DO UPDATE SET {assignments}"
+
+
+def insert_ignore_sql(dialect, table, columns, select=None):
+    # Rows whose key is already stored are skipped. `select` replaces the VALUES list
+    # and needs a WHERE clause, which SQLite requires before ON CONFLICT
+    names = ", ".join(columns)
+    source = select or f"VALUES ({', '.join(f':{column}' for column in columns)})"
+    if dialect in MYSQL_DIALECTS:
+        return f"INSERT IGNORE INTO {table} ({names}) {source}"
+    return f"INSERT INTO {table} ({names}) {source} ON CONFLICT DO NOTHING"
+
+
+def _index_exists(engine, table, index_name):
+    return any(index["name"] == index_name for index in inspect(engine).get_indexes(table))
+
+
+def _index_parts(engine, table, columns):
+    if engine.dialect.name not in MYSQL_DIALECTS:
+        return list(columns)
+    # MySQL can only index TEXT columns on a prefix
+    column_types = {column["name"]: column["type"] for column in inspect(engine).get_columns(table)}
+    return [f"{column}(64)" if isinstance(column_types.get(column), Text) else column for column in columns]
+
+
+def ensure_unique_key(engine, table, key):
+    index_name = f"uq_{table}_{'_'.join(key)}"
+    try:
+        if _index_exists(engine, table, index_name):
+            return True
+        parts = _index_parts(engine, table, key)
+        with engine.begin() as db:
+            db.execute(text(f"CREATE UNIQUE INDEX {index_name} ON {table} ({', '.join(parts)})"))
+        return True
+    except SQLAlchemyError as e:
+        # Typically the table already holds duplicated rows. Writes still go through,
+        # they just are not deduplicated by the database.
+        logger.warning("Could not create unique key %s on %s: %s", index_name, table, e)
+        return False
+
+
+def ensure_column(engine, table, column, definition):
+    if column in {existing["name"] for existing in inspect(engine).get_columns(table)}:
+        return
+    if "{serial_key}" in definition:
+        if engine.dialect.name not in SERIAL_KEYS:
+            raise RuntimeError(f"{table} predates {column} and {engine.dialect.name} cannot add it; "
+                               f"recreate the table")
+        definition = definition.format(serial_key=SERIAL_KEYS[engine.dialect.name])
+    try:
+        with engine.begin() as db:
+            db.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    except SQLAlchemyError:
+        # Another process added it in the meantime
+        if column not in {existing["name"] for existing in inspect(engine).get_columns(table)}:
+            raise
+
+
+def ensure_index(engine, table, columns):
+    index_name = f"ix_{table}_{'_'.join(columns)}"
+    if _index_exists(engine, table, index_name):
+        return
+    try:
+        with engine.begin() as db:
+            db.execute(text(f"CREATE INDEX {index_name} ON {table} ({', '.join(_index_parts(engine, table, columns))})"))
+    except SQLAlchemyError:
+        # Another process created it in the meantime
+        if not _index_exists(engine, table, index_name):
+            raise
+
+
+def is_legacy_table(engine, name=RESPONSES_TABLE):
+    return name in inspect(engine).get_table_names()
+
+
+def create_responses_view(engine):
+    with engine.begin() as db:
+        db.execute(text(f"CREATE VIEW {RESPONSES_TABLE} AS {RESPONSES_VIEW}"))
+
+
+def ensure_schema(engine):
+    # Tables and indexes first, then the Sheet1 view unless a legacy Sheet1
+    # table still holds that name (see migrate.py)
+    with engine.begin() as db:
+        for table, columns in TABLES.items():
+            columns = columns.format(serial=SERIAL_PRIMARY_KEYS[engine.dialect.name])
+            db.execute(text(f"CREATE TABLE IF NOT EXISTS {table} ({columns})"))
+    for table, columns in ADDED_COLUMNS.items():
+        for column, definition in columns.items():
+            ensure_column(engine, table, column, definition)
+    for table, indexes in INDEXES.items():
+        for columns in indexes:
+            ensure_index(engine, table, columns)
+
+    if is_legacy_table(engine):
+        logger.warning("%s is still a table; new responses go to %s until `python migrate.py` is run",
+                       RESPONSES_TABLE, TRIALS_TABLE)
+        return False
+    if RESPONSES_TABLE not in inspect(engine).get_view_names():
+        try:
+            create_responses_view(engine)
+        except SQLAlchemyError:
+            # Another process created it in the meantime
+            if RESPONSES_TABLE not in inspect(engine).get_view_names():
+                raise
+    return True
+
+
+def text_digest(statement_text):
+    return hashlib.sha1(statement_text.encode("utf-8")).hexdigest()
+
+
+def _insert_statements(db, dialect, statements):
+    # statements: (statement_id, statement_condition, text) triples; texts already stored are skipped
+    rows = {}
+    for statement_id, condition, statement_text in statements:
+        digest = text_digest(statement_text)
+        rows[digest] = {"text_sha1": digest, "statement_id": str(statement_id),
+                        "statement_condition": condition, "text": statement_text}
+    if rows:
+        db.execute(text(insert_ignore_sql(dialect, STATEMENTS_TABLE, STATEMENT_COLUMNS)), list(rows.values()))
+    return len(rows)
+
+
+def write_statements(engine, statements):
+    # statements: (statement_id, statement_condition, text) triples, e.g. the whole corpus
+    with engine.begin() as db:
+        return _insert_statements(db, engine.dialect.name, statements)
+
+
+def _upsert_participants(db, dialect, rows):
+    # The participant keeps the date of their first stored row
+    participants = {row["participant_id"]: row for row in rows}
+    db.execute(text(upsert_sql(dialect, PARTICIPANTS_TABLE, PARTICIPANT_COLUMNS, ["participant_id"],
+                               updates=["accuracy_condition", "prolific_id", "consent", "consent_time", "study"])),
+               [{**{column: row.get(column) for column in PARTICIPANT_COLUMNS}, "study": row.get("study") or DEFAULT_STUDY}
+                for row in participants.values()])
+
+
+def _upsert_trials(db, dialect, rows):
+    # The statement of each trial as well, in case the corpus was not stored up front
+    # (app-2.py only tries that once per process); the Sheet1 view would show no text otherwise
+    _insert_statements(db, dialect, ((row["statement_id"], row["statement_condition"], row["text"]) for row in rows))
+    db.execute(text(upsert_sql(dialect, TRIALS_TABLE, TRIAL_COLUMNS, RESPONSE_KEY)), [
+        {**{column: row.get(column) for column in TRIAL_COLUMNS if column != "text_sha1"},
+         "text_sha1": text_digest(row["text"])}
+        for row in rows
+    ])
+
+
+def write_responses(engine, rows):
+    # One executemany round-trip per table for all pending rows, committed together
+    if not rows:
+        return 0
+    with engine.begin() as db:
+        _upsert_participants(db, engine.dialect.name, rows)
+        _upsert_trials(db, engine.dialect.name, rows)
+    return len(rows)
+
+
+def write_session(engine, trial_rows, questionnaire_row):
+    # Everything a participant still has to store, in one transaction: either the
+    # whole session is in the database or none of it is, and a retry is harmless
+    with engine.begin() as db:
+        _upsert_participants(db, engine.dialect.name, [*trial_rows, questionnaire_row])
+        if trial_rows:
+            _upsert_trials(db, engine.dialect.name, trial_rows)
+        db.execute(text(upsert_sql(engine.dialect.name, QUESTIONNAIRE_TABLE, QUESTIONNAIRE_COLUMNS, ["participant_id"])),
+                   {column: questionnaire_row.get(column) for column in QUESTIONNAIRE_COLUMNS})
+    return len(trial_rows)
+
+
+# Read side, only used by the admin view. The text column is left out on purpose.
+# All three read the normalized tables, not the Sheet1 name, which is still the
+# legacy table until migrate.py has run.
+OVERVIEW_COLUMNS = [column for column in RESPONSE_COLUMNS if column != "text"]
+
+
+def count_responses(engine):
+    with engine.connect() as db:
+        return db.execute(text(f"SELECT COUNT(*) FROM {TRIALS_TABLE}")).scalar_one()
+
+
+def summarize_responses(engine):
+    query = f"""
+        SELECT p.accuracy_condition,
+               COUNT(DISTINCT t.participant_id) AS participants,
+               COUNT(*) AS trials
+        FROM {TRIALS_TABLE} t
+        JOIN {PARTICIPANTS_TABLE} p ON p.participant_id = t.participant_id
+        GROUP BY p.accuracy_condition
+    """
+    with engine.connect() as db:
+        return [dict(row) for row in db.execute(text(query)).mappings()]
+
+
+def read_responses_page(engine, limit, offset):
+    query = f"""
+        SELECT {', '.join(OVERVIEW_COLUMNS)}
+        FROM ({RESPONSES_VIEW}) responses
+        ORDER BY date DESC, participant_id
+        LIMIT :limit OFFSET :offset
+    """
+    with engine.connect() as db:
+        return [dict(row) for row in db.execute(text(query), {"limit": limit, "offset": offset}).mappings()]
+
+
+# Read side of the live dashboard: rows added after a given sequence number
+def read_trials_since(engine, after_seq, limit):
+    query = f"""
+        SELECT trial_seq, statement_condition, confidence_range, duration, ai_judgment, participant_judgment
+        FROM {TRIALS_TABLE}
+        WHERE trial_seq > :after_seq
+        ORDER BY trial_seq
+        LIMIT :limit
+    """
+    with engine.connect() as db:
+        return db.execute(text(query), {"after_seq": after_seq, "limit": limit}).all()
+
+
+def read_completions_since(engine, after_seq, limit):
+    query = f"""
+        SELECT q.questionnaire_seq, p.accuracy_condition
+        FROM {QUESTIONNAIRE_TABLE} q
+        JOIN {PARTICIPANTS_TABLE} p ON p.participant_id = q.participant_id
+        WHERE q.questionnaire_seq > :after_seq
+        ORDER BY q.questionnaire_seq
+        LIMIT :limit
+    """
+    with engine.connect() as db:
+        return db.execute(text(query), {"after_seq": after_seq, "limit": limit}).all()
@@ -0,0 +1,179 @@
+# Study definitions, so that one server process can host several variants of
+# the study side by side.
+#
+# A variant is a TOML file in studies/ (see studies/variant.toml.example) and
+# is selected with ?study=<file name> in the participant's link; without the
+# parameter, or with an unknown name, participants get the built-in "default"
+# study, the original one. A definition sets:
+#
+#   stimuli            statement CSV (default: hippocorpus_test_set.csv)
+#   strata             confidence ranges, one statement drawn from each
+#   attention_checks   [[attention_checks]] tables with id and position
+#   attention_options  answers offered for the accuracy question at the end
+#   [conditions.<name>]  accuracy (share of AI judgments that keep their sign)
+#                        and label (how the accuracy is shown, default e.g. "54%")
+#
+# Definitions are read and checked once per process into frozen Study objects.
+# compile_study() then ties a study to its memory-mapped corpus and the index
+# its plans are drawn from; studies with the same stimuli and attention checks
+# share one corpus, and all of them share the database pool, the write-behind
+# queue and the session store. Participants record their study in
+# participants.study.
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11; Streamlit depends on toml
+    import toml as tomllib
+
+import stimuli
+
+DEFAULT_STUDY = "default"
+STUDIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "studies")
+
+# Conditions of the default study: probability that the AI judgment keeps the sign of the statement's confidence
+ACCURACY_LEVELS = {"accuracy_low": 0.54, "accuracy_high": 0.89}
+
+ATTENTION_OPTIONS = ("I don't remember", "28%", "54%", "77%", "89%", "93%")
+
+NUMBER_WORDS = ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+                "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen",
+                "nineteen", "twenty")
+
+
+@dataclass(frozen=True)
+class Condition:
+    name: str
+    accuracy: float  # probability that the shown AI judgment keeps the sign of the statement's confidence
+    label: str       # accuracy as shown to participants
+
+
+@dataclass(frozen=True)
+class Study:
+    name: str
+    stimuli: str
+    conditions: tuple            # Condition, in order
+    strata: tuple                # confidence ranges
+    attention_checks: tuple      # (id, slider position)
+    attention_options: tuple = ATTENTION_OPTIONS
+
+    @property
+    def accuracy_levels(self):
+        return {condition.name: condition.accuracy for condition in self.conditions}
+
+    @property
+    def attention_check_rows(self):
+        return [stimuli.attention_check(check_id, position) for check_id, position in self.attention_checks]
+
+    @property
+    def trial_count(self):
+        return len(self.strata) + len(self.attention_checks)
+
+    @property
+    def trial_count_text(self):
+        count = self.trial_count
+        return NUMBER_WORDS[count] if count < len(NUMBER_WORDS) else str(count)
+
+    def condition(self, name):
+        return next(condition for condition in self.conditions if condition.name == name)
+
+    def plan_digest(self):
+        # Everything a stored plan depends on apart from the corpus
+        definition = [self.accuracy_levels, list(self.strata), [list(check) for check in self.attention_checks]]
+        return hashlib.sha1(json.dumps(definition, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _accuracy_label(accuracy):
+    return f"{accuracy * 100:g}%"
+
+
+DEFAULT = Study(
+    name=DEFAULT_STUDY,
+    stimuli=stimuli.STATEMENTS_FILE,
+    conditions=tuple(Condition(name, accuracy, _accuracy_label(accuracy)) for name, accuracy in ACCURACY_LEVELS.items()),
+    strata=tuple(stimuli.STATEMENT_RANGES),
+    attention_checks=tuple((check['truth-dec_pairID'], check['confidence']) for check in stimuli.ATTENTION_CHECKS),
+)
+
+
+def parse_study(name, definition, base_dir=os.path.dirname(STUDIES_DIR)):
+    # definition: the parsed TOML; raises ValueError on anything the app could not run
+    conditions = tuple(
+        Condition(condition_name, float(settings["accuracy"]),
+                  str(settings.get("label", _accuracy_label(float(settings["accuracy"])))))
+        for condition_name, settings in definition.get("conditions", {}).items()
+    ) or DEFAULT.conditions
+    if any(not 0 <= condition.accuracy <= 1 for condition in conditions):
+        raise ValueError(f"study {name}: accuracy must be between 0 and 1")
+
+    strata = tuple(int(stratum) for stratum in definition.get("strata", DEFAULT.strata))
+    if not strata or 0 in strata:
+        raise ValueError(f"study {name}: strata must be non-empty and cannot include 0 (the attention checks)")
+
+    checks = definition.get("attention_checks")
+    checks = DEFAULT.attention_checks if checks is None else tuple((str(check["id"]), int(check["position"])) for check in checks)
+    if any(not -50 <= position <= 50 for _, position in checks):
+        raise ValueError(f"study {name}: attention check positions must be between -50 and 50")
+
+    stimuli_path = definition.get("stimuli", DEFAULT.stimuli)
+    if not os.path.isabs(stimuli_path):
+        stimuli_path = os.path.relpath(os.path.join(base_dir, stimuli_path))
+    if not os.path.exists(stimuli_path):
+        raise ValueError(f"study {name}: stimulus file {stimuli_path} not found")
+
+    options = tuple(str(option) for option in definition.get("attention_options", ATTENTION_OPTIONS))
+    return Study(name, stimuli_path, conditions, strata, checks, options)
+
+
+def load_studies(studies_dir=STUDIES_DIR):
+    # name -> Study for the default study and every studies/<name>.toml
+    studies = {DEFAULT_STUDY: DEFAULT}
+    if os.path.isdir(studies_dir):
+        for file_name in sorted(os.listdir(studies_dir)):
+            name, extension = os.path.splitext(file_name)
+            if extension != ".toml":
+                continue
+            with open(os.path.join(studies_dir, file_name), encoding="utf-8") as f:
+                studies[name] = parse_study(name, tomllib.loads(f.read()))
+    return MappingProxyType(studies)
+
+
+def select(studies, requested):
+    # Name of the study for a ?study= value (None when not given)
+    return requested if requested in studies else DEFAULT_STUDY
+
+
+@dataclass(frozen=True)
+class CompiledStudy:
+    study: Study
+    corpus: object = field(repr=False)     # stimuli.StatementStore, shared with other studies
+    range_index: MappingProxyType = field(repr=False)         # stratum -> corpus row positions
+    attention_positions: object = field(repr=False)   # corpus row positions of the attention checks
+    plan_version: str = ""                 # identifies the plans in the trial_plans pool
+
+
+def open_corpus(study):
+    return stimuli.open_store(study.stimuli, attention_checks=study.attention_check_rows)
+
+
+def compile_study(study, corpus=None):
+    corpus = corpus if corpus is not None else open_corpus(study)
+    range_index = stimuli.build_range_index(corpus, study.strata)
+    missing = [stratum for stratum in study.strata if stratum not in range_index]
+    if missing:
+        raise ValueError(f"study {study.name}: no statements in strata {missing}")
+    for positions in range_index.values():
+        positions.flags.writeable = False
+    attention_positions = stimuli.attention_check_positions(corpus)
+    attention_positions.flags.writeable = False
+
+    # The default study keeps the corpus version, so pools generated before studies existed stay valid
+    plan_version = corpus.version
+    if study.name != DEFAULT_STUDY:
+        plan_version = hashlib.sha1((corpus.version + study.plan_digest()).encode("utf-8")).hexdigest()[:16]
+    return CompiledStudy(study, corpus, MappingProxyType(range_index), attention_positions, plan_version)
@@ -0,0 +1,75 @@
+# Compact per-session trial state.
+#
+# A TrialPlan refers to statements by their row position in the shared corpus
+# (see stimuli.py) and holds the AI judgment of every trial, computed once when
+# the plan is made. TrialResponses stores the answers in fixed-size arrays, so
+# a session keeps a few hundred bytes instead of DataFrame copies of the stories.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+def is_prediction_correct(confidences, statement_conditions):
+    confidences = np.asarray(confidences)
+    statement_conditions = np.asarray(statement_conditions)
+    return (((statement_conditions == "truthful") & (confidences >= 0))
+            | ((statement_conditions == "deceptive") & (confidences < 0)))
+
+
+@dataclass(slots=True)
+class TrialPlan:
+    positions: np.ndarray            # row positions in the corpus
+    ai_judgments: np.ndarray         # judgment shown on the AI slider
+    correct_predictions: np.ndarray  # whether the shown judgment points the right way
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def trial_plan_with_flips(corpus, positions, flipped):
+    positions = np.asarray(positions, dtype=np.intp)
+    confidences = corpus.column('confidence')[positions].astype(np.int8)
+    conditions = corpus.column('condition')[positions]
+
+    # Attention checks always show their fixed value
+    flipped = np.asarray(flipped, dtype=bool) & (conditions != "attention_check")
+    ai_judgments = np.where(flipped, -confidences, confidences).astype(np.int8)
+    return TrialPlan(positions, ai_judgments, is_prediction_correct(ai_judgments, conditions))
+
+
+@dataclass(slots=True)
+class TrialResponses:
+    # Reading times are measured with perf_counter_ns, which only compares within
+    # one process; start_times (wall clock) is kept for the date of the trial.
+    participant_judgments: np.ndarray  # int8, -50..+50
+    start_times: np.ndarray            # float64 epoch seconds, NaN until the trial is first shown
+    start_ns: np.ndarray               # int64 perf_counter_ns when the trial was shown, 0 until then
+    duration_ns: np.ndarray            # int64 server-side reading time, -1 until submitted
+    client_duration_us: np.ndarray     # int64 reading time measured in the browser, -1 if not reported
+
+    @classmethod
+    def empty(cls, trial_count):
+        return cls(
+            participant_judgments=np.zeros(trial_count, dtype=np.int8),
+            start_times=np.full(trial_count, np.nan),
+            start_ns=np.zeros(trial_count, dtype=np.int64),
+            duration_ns=np.full(trial_count, -1, dtype=np.int64),
+            client_duration_us=np.full(trial_count, -1, dtype=np.int64),
+        )
+
+    def start(self, index, now_ns, wall_time):
+        if self.start_ns[index] == 0:
+            self.start_ns[index] = now_ns
+            self.start_times[index] = wall_time
+
+    def record(self, index, participant_judgment, now_ns, client_duration_us=None):
+        self.participant_judgments[index] = participant_judgment
+        self.duration_ns[index] = now_ns - self.start_ns[index]
+        if client_duration_us is not None:
+            self.client_duration_us[index] = client_duration_us
+        return int(self.duration_ns[index])
+
+    def restart_unfinished(self):
+        # After a reconnect, possibly to another process: trials not submitted yet are timed again
+        unfinished = self.duration_ns < 0
+        self.start_ns[unfinished] = 0
@@ -0,0 +1,259 @@
+# Write-behind queue for trial responses.
+#
+# Submit hands a row to the queue and returns straight away. A background thread
+# writes the rows in small batches through storage.write_responses, retries with
+# backoff when the database errors, and appends the batch to a local JSON-lines
+# journal if the database stays unreachable. The journal is replayed once the
+# database answers again; the upsert makes replaying a row twice harmless.
+#
+# The writer also creates the tables (storage.ensure_schema) before its first
+# write, so a database that is down when the app starts only means journaled rows.
+#
+# Several server processes share the journal file, so appending and replaying
+# hold an exclusive lock on <journal>.lock (fcntl). Without fcntl (Windows)
+# each process keeps a journal of its own, <journal>.<pid>. A line cut short by
+# a crash is logged and skipped on replay.
+#
+# Only connection errors (OperationalError, InterfaceError) mean the database is
+# down. A batch the database rejects for its data is written again row by row,
+# and the rows it still rejects go to <journal>.rejected with the error, so one
+# bad row cannot hold up the others or the replay.
+
+import atexit
+import contextlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+
+import metrics
+import storage
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+_journal_locks = {}  # journal path -> lock of this process
+_journal_locks_guard = threading.Lock()
+
+
+def journal_path_for(path):
+    # Without fcntl, each process keeps a journal of its own
+    return path if fcntl else f"{path}.{os.getpid()}"
+
+
+@contextlib.contextmanager
+def locked_journal(path):
+    # The thread lock serializes this process, the file lock the other processes
+    with _journal_locks_guard:
+        lock = _journal_locks.setdefault(path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _append_lines(path, rows):
+    with locked_journal(path):
+        with open(path, "a", encoding="utf-8") as journal:
+            for row in rows:
+                journal.write(json.dumps(row) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+
+def append_to_journal(path, rows):
+    _append_lines(path, rows)
+    metrics.inc("app_responses_journaled_total", len(rows))
+
+
+class WriteBehindQueue:
+    def __init__(self, engine, journal_path, batch_size=50, flush_interval=0.2,
+                 retries=3, retry_delay=0.5, max_replay_delay=60):
+        self.engine = engine
+        self.journal_path = journal_path_for(journal_path)
+        self.rejected_path = self.journal_path + ".rejected"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_replay_delay = max_replay_delay
+
+        self._queue = queue.Queue()
+        self._schema_ready = False
+        self._stopped = threading.Event()
+        self._replay_delay = retry_delay
+        self._next_replay = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="response-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, row):
+        self._queue.put(row)
+        metrics.set_gauge("app_write_queue_depth", self._queue.qsize())
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=5):
+        # Let the thread finish its batch, then keep whatever is left in the journal
+        self._stopped.set()
+        self._thread.join(timeout)
+        leftover = self._drain(block=False)
+        if leftover:
+            self._spill(leftover)
+
+    def _run(self):
+        # Nothing may end this thread: later submits would only pile up in the queue
+        while not self._stopped.is_set():
+            rows = []
+            try:
+                rows = self._drain(block=True)
+                if rows and (unwritten := self._write_with_retry(rows)):
+                    self._spill(unwritten)
+                rows = []
+                if time.monotonic() >= self._next_replay and os.path.exists(self.journal_path):
+                    self._replay_journal()
+            except Exception:
+                logger.exception("Response writer failed")
+                if rows:
+                    with contextlib.suppress(Exception):
+                        self._spill(rows)
+                self._back_off_replay()
+
+    def _drain(self, block):
+        rows = []
+        try:
+            if block:
+                rows.append(self._queue.get(timeout=self.flush_interval))
+            while len(rows) < self.batch_size:
+                rows.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _prepare(self):
+        # Tables first; until that works the database counts as down
+        if not self._schema_ready:
+            storage.ensure_schema(self.engine)
+            self._schema_ready = True
+
+    def _write(self, rows):
+        # Returns the rows left unwritten because the database went away
+        self._prepare()
+        try:
+            with metrics.timed("app_phase_seconds", phase="db_write"):
+                storage.write_responses(self.engine, rows)
+        except TRANSIENT_ERRORS:
+            raise
+        except SQLAlchemyError as e:
+            logger.warning("A batch of %d responses was rejected, writing them one by one: %s", len(rows), e)
+            return self._write_one_by_one(rows)
+        metrics.inc("app_responses_written_total", len(rows))
+        metrics.set_gauge("app_write_queue_depth", self._queue.qsize())
+        return []
+
+    def _write_one_by_one(self, rows):
+        for position, row in enumerate(rows):
+            try:
+                storage.write_responses(self.engine, [row])
+            except TRANSIENT_ERRORS as e:
+                logger.warning("Writing responses one by one stopped, %d left: %s", len(rows) - position, e)
+                return rows[position:]
+            except SQLAlchemyError as e:
+                self._reject(row, e)
+            else:
+                metrics.inc("app_responses_written_total")
+        return []
+
+    def _write_with_retry(self, rows):
+        # Returns the rows still unwritten after the last attempt
+        for attempt in range(self.retries):
+            try:
+                rows = self._write(rows)
+                if not rows:
+                    return []
+            except TRANSIENT_ERRORS as e:
+                logger.warning("Writing %d responses failed (attempt %d/%d): %s",
+                               len(rows), attempt + 1, self.retries, e)
+            if attempt + 1 < self.retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+        return rows
+
+    def _reject(self, row, error):
+        _append_lines(self.rejected_path, [{"error": str(getattr(error, "orig", None) or error), "row": row}])
+        metrics.inc("app_responses_rejected_total")
+        logger.error("Response of %s rejected by the database, kept in %s: %s",
+                     row.get("participant_id"), self.rejected_path, error)
+
+    def _back_off_replay(self):
+        self._next_replay = time.monotonic() + self._replay_delay
+        self._replay_delay = min(self._replay_delay * 2, self.max_replay_delay)
+
+    def _read_journal(self):
+        rows = []
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for number, line in enumerate(journal, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.error("Skipping corrupt line %d of %s: %.80r", number, self.journal_path, line)
+        return rows
+
+    def _rewrite_journal(self, rows):
+        # Called with the journal locked
+        partial_path = self.journal_path + ".partial"
+        with open(partial_path, "w", encoding="utf-8") as journal:
+            for row in rows:
+                journal.write(json.dumps(row) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(partial_path, self.journal_path)
+
+    def _spill(self, rows):
+        append_to_journal(self.journal_path, rows)
+        logger.error("Database unreachable, %d responses kept in %s", len(rows), self.journal_path)
+
+    def _replay_journal(self):
+        with locked_journal(self.journal_path):
+            # Another process may have replayed it while this one waited for the lock
+            if not os.path.exists(self.journal_path):
+                return
+            rows = self._read_journal()
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    unwritten = self._write(batch)
+                except TRANSIENT_ERRORS as e:
+                    unwritten = batch
+                    logger.warning("Replaying %s failed: %s", self.journal_path, e)
+                if unwritten:
+                    # Still down: keep what is left and back off before the next attempt
+                    if start or len(unwritten) < len(batch):
+                        self._rewrite_journal(unwritten + rows[start + self.batch_size:])
+                    self._back_off_replay()
+                    logger.warning("%d journaled responses left, next replay in %.0fs",
+                                   len(unwritten) + len(rows) - start - len(batch),
+                                   self._next_replay - time.monotonic())
+                    return
+            os.remove(self.journal_path)
+        self._replay_delay = self.retry_delay
+        logger.info("Replayed %d journaled responses", len(rows))